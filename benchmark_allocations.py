@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Benchmark for per-turn allocations on the transcription upload path
+
+Compares the current in-memory upload in main.transcribe_audio with the
+previous approach (write the clip to a NamedTemporaryFile, reopen it for the
+upload, unlink it) against a simulated OpenAI backend. tracemalloc measures
+the peak Python memory each turn allocates on top of the clip itself.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+
+import httpx
+
+import main
+
+class SimulatedOpenAI(httpx.AsyncBaseTransport):
+    """Stream the upload out and discard it, like a socket would, and answer at once
+
+    httpx.MockTransport reads the whole body into memory first, which would hide the difference.
+    """
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        async for _ in request.stream:
+            pass
+        return httpx.Response(200, json={"text": "What is the weather like today?"})
+
+async def tempfile_transcribe(audio_data: bytes) -> str:
+    """The previous upload path: the clip goes through a temporary file on disk"""
+    with tempfile.NamedTemporaryFile(suffix=".webm", delete=False) as temp_file:
+        temp_file.write(audio_data)
+        temp_file_path = temp_file.name
+    try:
+        with open(temp_file_path, "rb") as audio_file:
+            transcript = await main.client.audio.transcriptions.create(model="whisper-1", file=audio_file)
+    finally:
+        os.unlink(temp_file_path)
+    return transcript.text.strip()
+
+async def measure(transcribe, audio_data: bytes, turns: int):
+    """Return (average peak bytes allocated per turn, average seconds per turn)"""
+    # Warm up the connection pool and code paths outside the measurement
+    await transcribe(audio_data)
+
+    peak_total = 0
+    started = time.perf_counter()
+    tracemalloc.start()
+    for _ in range(turns):
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        await transcribe(audio_data)
+        _, peak = tracemalloc.get_traced_memory()
+        peak_total += peak - baseline
+    tracemalloc.stop()
+    elapsed = time.perf_counter() - started
+    return peak_total / turns, elapsed / turns
+
+async def benchmark(turns: int, clip_kib: int):
+    main.client = main.create_openai_client("sk-benchmark", transport=SimulatedOpenAI())
+    # Every turn sends the same clip; without this all but the first would be transcription cache hits
+    main.transcription_cache = main.TwoTierCache("transcription", max_bytes=0)
+    audio_data = b"\x1a\x45\xdf\xa3" + os.urandom(clip_kib * 1024)
+    try:
+        before = await measure(tempfile_transcribe, audio_data, turns)
+        after = await measure(main.transcribe_audio, audio_data, turns)
+    finally:
+        await main.client.close()
+
+    print(f"Clip size:           {clip_kib} KiB, {turns} turns each")
+    print(f"Temp file upload:    {before[0] / 1024:8.1f} KiB peak/turn  {before[1] * 1000:6.2f} ms/turn")
+    print(f"In-memory upload:    {after[0] / 1024:8.1f} KiB peak/turn  {after[1] * 1000:6.2f} ms/turn")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--turns", type=int, default=200, help="turns to measure per variant")
+    parser.add_argument("--clip-kib", type=int, default=256, help="size of the simulated clip in KiB")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(benchmark(args.turns, args.clip_kib))
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Benchmark for concurrent voice sessions
+
+Runs the STT -> LLM -> TTS pipeline from main.py against a simulated OpenAI
+backend with fixed per-stage latency. Because every upstream call is awaited
+on the shared async client, N concurrent sessions should finish in roughly
+the time of a single session rather than N times as long.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+import os
+
+import httpx
+
+# Measure the event loop, not the upstream admission limits
+for stage_limit in ("STT_CONCURRENCY", "CHAT_CONCURRENCY", "TTS_CONCURRENCY"):
+    os.environ.setdefault(stage_limit, "1000")
+
+import main
+
+STAGE_LATENCY = {
+    "/v1/audio/transcriptions": 0.30,
+    "/v1/chat/completions": 0.40,
+    "/v1/audio/speech": 0.30,
+}
+
+async def simulated_openai(request: httpx.Request) -> httpx.Response:
+    """Answer OpenAI API requests after a fixed, stage-specific delay"""
+    await asyncio.sleep(STAGE_LATENCY.get(request.url.path, 0.0))
+
+    if request.url.path == "/v1/audio/transcriptions":
+        return httpx.Response(200, json={"text": "What is the weather like today?"})
+    if request.url.path == "/v1/chat/completions":
+        return httpx.Response(200, json={
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": "gpt-3.5-turbo",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "It looks sunny with a light breeze."},
+                "finish_reason": "stop",
+            }],
+        })
+    if request.url.path == "/v1/audio/speech":
+        return httpx.Response(200, content=b"\x00" * 16_000, headers={"content-type": "audio/mpeg"})
+    return httpx.Response(404, content=json.dumps({"error": "not found"}))
+
+async def run_turn() -> None:
+    """Run one full voice turn through the pipeline"""
+    text = await main.transcribe_audio(b"\x1a\x45\xdf\xa3" + b"\x00" * 32_000)
+    reply = await main.get_ai_response_async(text)
+    await main.generate_speech(reply)
+
+async def run_sessions(count: int) -> float:
+    """Run `count` sessions concurrently and return the wall-clock time"""
+    start = time.perf_counter()
+    await asyncio.gather(*(run_turn() for _ in range(count)))
+    return time.perf_counter() - start
+
+async def benchmark(sessions: int):
+    main.client = main.create_openai_client(
+        "sk-benchmark", transport=httpx.MockTransport(simulated_openai)
+    )
+    # Every turn sends the same clip and gets the same reply; measure real transcriptions
+    # and speech synthesis rather than cache hits
+    main.transcription_cache = main.TwoTierCache("transcription", max_bytes=0)
+    main.speech_cache = main.TwoTierCache("tts", max_bytes=0)
+    try:
+        # Warm up the connection pool and code paths
+        await run_sessions(1)
+
+        single = await run_sessions(1)
+        concurrent = await run_sessions(sessions)
+    finally:
+        await main.client.close()
+
+    print(f"1 session:            {single:.3f}s")
+    print(f"{sessions} concurrent sessions: {concurrent:.3f}s")
+    print(f"Serial estimate:      {single * sessions:.3f}s")
+    print(f"Slowdown vs single:   {concurrent / single:.2f}x (ideal 1.00x, blocking client {sessions}.00x)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=20, help="number of concurrent sessions")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(benchmark(args.sessions))
@@ -0,0 +1,165 @@
+"""
+Two-tier byte cache: an in-memory LRU backed by an optional disk directory
+
+The memory tier is bounded by the total size of its values and evicts the
+least recently used entries. The disk tier stores one file per key so cached
+values survive restarts; a disk hit is promoted back into memory. Keys should
+be hex digests (they are used as file names). The disk tier is bounded too:
+once its files exceed max_disk_bytes the oldest written are deleted, and the
+files already in the directory are counted at startup.
+"""
+import asyncio
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class TwoTierCache:
+    def __init__(self, name: str, max_bytes: int, directory: Optional[str] = None,
+                 max_disk_bytes: int = 256 * 1024 * 1024):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.directory = directory or None
+        self.max_disk_bytes = max_disk_bytes
+        self.entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Files on disk, oldest written first; writes run in worker threads
+        self.disk_entries: "OrderedDict[str, int]" = OrderedDict()
+        self.disk_size = 0
+        self.disk_evictions = 0
+        self.disk_lock = threading.Lock()
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            self._scan()
+
+    async def get(self, key: str) -> Optional[bytes]:
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+        if self.directory:
+            value = await asyncio.to_thread(self._read, key)
+            if value is not None:
+                self.hits += 1
+                self.disk_hits += 1
+                self._remember(key, value)
+                return value
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, value: bytes):
+        self._remember(key, value)
+        if self.directory:
+            await asyncio.to_thread(self._write, key, value)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "disk": bool(self.directory),
+            "disk_entries": len(self.disk_entries),
+            "disk_bytes": self.disk_size,
+            "max_disk_bytes": self.max_disk_bytes,
+            "disk_evictions": self.disk_evictions,
+        }
+
+    def _remember(self, key: str, value: bytes):
+        if len(value) > self.max_bytes:
+            return  # would evict everything else
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self.size -= len(previous)
+        self.entries[key] = value
+        self.size += len(value)
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    def _path(self, key: str) -> str:
+        # Two-character fan-out keeps directories small
+        return os.path.join(self.directory, key[:2], key)
+
+    def _read(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"Could not read {self.name} cache entry {key}: {e}")
+            return None
+
+    def _scan(self):
+        found = []
+        for prefix in os.listdir(self.directory):
+            subdirectory = os.path.join(self.directory, prefix)
+            if not os.path.isdir(subdirectory):
+                continue
+            for key in os.listdir(subdirectory):
+                if not key.startswith(prefix):
+                    continue  # temporary file left by an interrupted write
+                try:
+                    stat = os.stat(os.path.join(subdirectory, key))
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, key, stat.st_size))
+        for _, key, size in sorted(found):
+            self.disk_entries[key] = size
+            self.disk_size += size
+        logger.info(f"{self.name} cache: {len(found)} entries ({self.disk_size} bytes) on disk")
+        self._evict_disk()
+
+    def _evict_disk(self):
+        # Caller holds disk_lock or is still in __init__
+        while self.disk_size > self.max_disk_bytes and self.disk_entries:
+            key, size = self.disk_entries.popitem(last=False)
+            self.disk_size -= size
+            self.disk_evictions += 1
+            try:
+                os.unlink(self._path(key))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Could not delete {self.name} cache entry {key}: {e}")
+
+    def _write(self, key: str, value: bytes):
+        if len(value) > self.max_disk_bytes:
+            return  # would evict everything else
+        path = self._path(key)
+        temp_path = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file and rename, so readers never see a partial entry
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(value)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write {self.name} cache entry {key}: {e}")
+            if temp_path and os.path.exists(temp_path):
+                os.unlink(temp_path)
+            return
+        with self.disk_lock:
+            previous = self.disk_entries.pop(key, None)
+            if previous is not None:
+                self.disk_size -= previous
+            self.disk_entries[key] = len(value)
+            self.disk_size += len(value)
+            self._evict_disk()
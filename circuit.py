@@ -0,0 +1,92 @@
+"""
+Circuit breakers for upstream OpenAI stages
+
+After enough consecutive failures (overloads, 5xx, timeouts, connection
+errors) a stage's breaker opens and requests fail immediately instead of
+waiting out the HTTP timeout. Once the reset timeout has passed, a single
+probe request is let through (half-open): if it succeeds the breaker closes,
+otherwise it opens again for another reset period.
+"""
+import os
+import time
+from typing import Dict
+
+# Consecutive failures that open a stage's breaker
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+
+# Seconds an open breaker waits before letting a probe request through
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a stage whose breaker is open"""
+
+    def __init__(self, stage: str, retry_in: float):
+        super().__init__(f"{stage} circuit is open, retry in {retry_in:.1f}s")
+        self.stage = stage
+        self.retry_in = retry_in
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.times_opened = 0
+        self.rejected = 0
+
+    @property
+    def is_open(self) -> bool:
+        """Whether requests are currently being rejected outright"""
+        if self.state == OPEN:
+            return self._retry_in() > 0
+        return self.state == HALF_OPEN and self.probing
+
+    def check(self):
+        """Admit a request or raise CircuitOpenError; in half-open state only one probe is admitted"""
+        if self.state == OPEN and self._retry_in() <= 0:
+            self.state = HALF_OPEN
+        if self.state == CLOSED:
+            return
+        if self.state == HALF_OPEN and not self.probing:
+            self.probing = True
+            return
+        self.rejected += 1
+        raise CircuitOpenError(self.name, self._retry_in())
+
+    def record_success(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.times_opened += 1
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+    def abandon(self):
+        """Forget an admitted request that was cancelled before it finished"""
+        self.probing = False
+
+    def stats(self) -> Dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+            "retry_in_s": round(self._retry_in(), 1) if self.state == OPEN else 0.0,
+        }
+
+    def _retry_in(self) -> float:
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
@@ -0,0 +1,118 @@
+"""
+Token-budgeted conversation context for chat completions
+
+Previous turns are sent as user/assistant messages after the fixed system
+prompt, newest last, and only as many of them as fit CONTEXT_TOKEN_BUDGET by
+a fast local token estimate. The prompt therefore stays bounded however
+long individual turns are.
+
+To let provider-side prompt caching reuse the prefix of the previous
+request, the oldest turn sent only moves forward in steps of
+CONTEXT_WINDOW_STEP turns (by message seq) instead of on every turn.
+"""
+import os
+import re
+from typing import Dict, List, Optional
+
+from database import CONTEXT_CACHE_TURNS
+
+# Tokens of conversation history sent with each request
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+
+# Most previous turns considered; by default what the session context cache holds
+CONTEXT_MAX_TURNS = int(os.getenv("CONTEXT_MAX_TURNS", str(CONTEXT_CACHE_TURNS)))
+
+# The history window starts at a message whose seq is a multiple of this
+CONTEXT_WINDOW_STEP = int(os.getenv("CONTEXT_WINDOW_STEP", "4"))
+
+# Role and separator tokens the chat format adds to every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# A turn that would have to be cut to fewer tokens than this is left out instead
+MIN_TRUNCATED_TOKENS = 64
+
+_WORDS = re.compile(r"\w+|[^\w\s]")
+
+def estimate_tokens(text: str) -> int:
+    """Approximate BPE token count, erring high
+
+    About four ASCII characters per token but at least one per word or punctuation mark,
+    and one per non-ASCII character (CJK, emoji and accented letters often take one or more).
+    """
+    if not text:
+        return 0
+    non_ascii = len(text) - len(text.encode("ascii", "ignore"))
+    return max(len(_WORDS.findall(text)), (len(text) - non_ascii + 3) // 4) + non_ascii
+
+def turn_tokens(turn: Dict) -> int:
+    return (estimate_tokens(turn.get("user_message")) + estimate_tokens(turn.get("ai_response"))
+            + 2 * MESSAGE_OVERHEAD_TOKENS)
+
+def truncate_text(text: str, max_tokens: int) -> str:
+    """The longest start of `text`, cut at a word, that fits `max_tokens` with the "…" marking the cut"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle] + " …") <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    cut = text[:low]
+    if low < len(text) and not text[low].isspace() and " " in cut:
+        cut = cut[:cut.rindex(" ")]
+    return cut.rstrip() + " …" if cut.strip() else ""
+
+def truncate_turn(turn: Dict, budget: int) -> Optional[Dict]:
+    """A copy of the turn cut down to `budget` tokens, or None if too little of it would be left"""
+    available = budget - 2 * MESSAGE_OVERHEAD_TOKENS
+    if available < MIN_TRUNCATED_TOKENS:
+        return None
+    user_tokens = estimate_tokens(turn["user_message"])
+    # Each side gets half, and whatever the other side does not need
+    user_budget = max(available // 2, available - estimate_tokens(turn["ai_response"]))
+    user_message = truncate_text(turn["user_message"], min(user_tokens, user_budget))
+    ai_response = truncate_text(turn["ai_response"], available - estimate_tokens(user_message))
+    if not user_message or not ai_response:
+        return None
+    return {**turn, "user_message": user_message, "ai_response": ai_response}
+
+def select_turns(history: List[Dict], budget: int = CONTEXT_TOKEN_BUDGET) -> List[Dict]:
+    """The most recent turns that fit the budget, starting on a window step where possible
+
+    The history stays contiguous: the first turn that does not fit is cut down to the rest of the
+    budget (see truncate_turn) and older turns are left out.
+    """
+    history = [turn for turn in history if turn.get("user_message") and turn.get("ai_response")]
+    selected = []
+    total = 0
+    for turn in reversed(history):
+        tokens = turn_tokens(turn)
+        if total + tokens > budget:
+            truncated = truncate_turn(turn, budget - total)
+            if truncated:
+                selected.append(truncated)
+            break
+        total += tokens
+        selected.append(turn)
+    selected.reverse()
+
+    # Move the start up to the next step boundary, unless that would leave nothing
+    aligned = 0
+    while aligned < len(selected) and selected[aligned].get("seq") is not None \
+            and selected[aligned]["seq"] % CONTEXT_WINDOW_STEP:
+        aligned += 1
+    if aligned < len(selected) and selected[aligned].get("seq") is not None:
+        return selected[aligned:]
+    return selected
+
+def build_messages(system_prompt: str, history: List[Dict], user_message: str,
+                   budget: int = CONTEXT_TOKEN_BUDGET) -> List[Dict]:
+    """Chat messages: system prompt, the previous turns that fit the budget, then the new user message"""
+    messages = [{"role": "system", "content": system_prompt}]
+    for turn in select_turns(history, budget):
+        messages.append({"role": "user", "content": turn["user_message"]})
+        messages.append({"role": "assistant", "content": turn["ai_response"]})
+    messages.append({"role": "user", "content": user_message})
+    return messages
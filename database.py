@@ -1,18 +1,67 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
+import asyncio
 import os
 from dotenv import load_dotenv
 import logging
+from session_cache import SessionContextCache
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+# Messages per bucket document. Each session's messages are numbered from 0 (seq) and
+# message seq lives in bucket seq // MESSAGE_BUCKET_SIZE, so a session's documents stay
+# small and reads only touch its newest bucket or two.
+MESSAGE_BUCKET_SIZE = int(os.getenv("MESSAGE_BUCKET_SIZE", "50"))
+
+# Write-behind: messages are queued and written in batches, off the response path.
+# When the queue is full, add_message waits for room (backpressure), but only for
+# DB_WRITE_QUEUE_TIMEOUT seconds: after that the message is dropped, so a database
+# outage cannot pile up waiting messages without limit.
+DB_WRITE_QUEUE_SIZE = int(os.getenv("DB_WRITE_QUEUE_SIZE", "1000"))
+DB_WRITE_QUEUE_TIMEOUT = float(os.getenv("DB_WRITE_QUEUE_TIMEOUT", "5"))
+DB_WRITE_BATCH_SIZE = int(os.getenv("DB_WRITE_BATCH_SIZE", "200"))
+
+# How long the writer waits for more messages to join a batch, in seconds
+DB_WRITE_INTERVAL = float(os.getenv("DB_WRITE_INTERVAL", "0.05"))
+
+# Attempts for a failed batch before its messages are dropped
+DB_WRITE_ATTEMPTS = 3
+
+# MongoDB's error code for a unique index violation
+DUPLICATE_KEY_ERROR = 11000
+
+# Longest wait for queued messages to be written on shutdown, in seconds
+DB_FLUSH_TIMEOUT = float(os.getenv("DB_FLUSH_TIMEOUT", "10"))
+
+# Recent messages kept in memory per session, so building context rarely reads the database
+CONTEXT_CACHE_TURNS = int(os.getenv("CONTEXT_CACHE_TURNS", "20"))
+CONTEXT_CACHE_TTL = float(os.getenv("CONTEXT_CACHE_TTL", "1800"))
+CONTEXT_CACHE_BYTES = int(os.getenv("CONTEXT_CACHE_BYTES", str(32 * 1024 * 1024)))
+
+def bucket_for(seq: int) -> int:
+    """Bucket holding message `seq`; migrated legacy messages have negative seqs and buckets"""
+    return seq // MESSAGE_BUCKET_SIZE
+
 class MongoDatabase:
     def __init__(self):
         self.client = None
         self.database = None
-        self.conversations = None
+        self.conversations = None  # one small header document per session
+        self.message_buckets = None  # the session's messages, MESSAGE_BUCKET_SIZE per document
+        self.write_queue: asyncio.Queue = None  # (session_id, message) waiting for the writer
+        self.unflushed: Dict[str, List[Dict]] = {}  # queued or in-flight messages by session, merged into reads
+        self.writer: Optional[asyncio.Task] = None
+        self.closing = False  # set once flush() starts; new messages are dropped
+        self.waiting_puts = 0  # add_message calls waiting for room in the queue
+        self.write_lock = asyncio.Lock()  # held while a batch is being written
+        self.batches_written = 0
+        self.messages_written = 0
+        self.messages_dropped = 0
+        self.context_cache = SessionContextCache(CONTEXT_CACHE_TURNS, CONTEXT_CACHE_TTL, CONTEXT_CACHE_BYTES)
         
     async def connect(self):
         try:
@@ -23,16 +72,23 @@ class MongoDatabase:
             self.client = AsyncIOMotorClient(mongo_uri)
             self.database = self.client[db_name]
             self.conversations = self.database.conversations
+            self.message_buckets = self.database.message_buckets
             
             # Test the connection
             await self.client.admin.command('ismaster')
+            await self.message_buckets.create_index([("session_id", 1), ("bucket_seq", 1)], unique=True)
             logger.info(f"Connected to MongoDB at {mongo_uri}")
             
+            self.write_queue = asyncio.Queue(maxsize=DB_WRITE_QUEUE_SIZE)
+            self.closing = False
+            self.writer = asyncio.create_task(self._write_behind())
+            
         except Exception as e:
             logger.error(f"Failed to connect to MongoDB: {e}")
             raise
     
     async def disconnect(self):
+        await self.flush()
         if self.client:
             self.client.close()
             logger.info("Disconnected from MongoDB")
@@ -43,7 +99,7 @@ class MongoDatabase:
             "session_id": session_id,
             "created_at": datetime.utcnow(),
             "updated_at": datetime.utcnow(),
-            "messages": []
+            "message_count": 0
         }
         
         result = await self.conversations.insert_one(conversation)
@@ -51,35 +107,278 @@ class MongoDatabase:
         return str(result.inserted_id)
     
     async def add_message(self, session_id: str, user_message: str, ai_response: str, transcription: Optional[str] = None):
-        """Add a message exchange to the conversation"""
+        """Add a message exchange to the conversation
+        
+        Returns once the message is queued; it is written with the next batch and reads see it right away.
+        Messages that find the queue full for DB_WRITE_QUEUE_TIMEOUT, or arrive during shutdown, are dropped.
+        """
+        if self.closing:
+            self._drop(session_id, "the database is shutting down")
+            return
         message_entry = {
             "timestamp": datetime.utcnow(),
             "user_message": user_message,
             "ai_response": ai_response,
             "transcription": transcription
         }
+        self.context_cache.append(session_id, message_entry)
+        if self.writer is None:
+            # Not connected through connect(): write straight away
+            failed = await self._write_batch([(session_id, message_entry)])
+            if failed:
+                self.context_cache.invalidate(session_id)
+                raise RuntimeError(f"Could not add message to conversation {session_id}")
+            return
         
-        await self.conversations.update_one(
-            {"session_id": session_id},
+        pending = self.unflushed.setdefault(session_id, [])
+        pending.append(message_entry)
+        self.waiting_puts += 1
+        try:
+            await asyncio.wait_for(self.write_queue.put((session_id, message_entry)), DB_WRITE_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self._forget(session_id, message_entry)
+            self._drop(session_id, f"the write queue stayed full for {DB_WRITE_QUEUE_TIMEOUT}s")
+            return
+        except BaseException:
+            self._forget(session_id, message_entry)
+            self.context_cache.invalidate(session_id)
+            raise
+        finally:
+            self.waiting_puts -= 1
+        if self.writer is None:
+            # Queued just as flush() finished: nothing will ever write it
+            self._forget(session_id, message_entry)
+            self._drop(session_id, "the writer has stopped")
+    
+    async def flush(self, timeout: float = DB_FLUSH_TIMEOUT):
+        """Write every queued message and stop the writer"""
+        if self.writer is None:
+            return
+        # Stop taking messages first, so the queue can actually drain
+        self.closing = True
+        try:
+            await asyncio.wait_for(self.write_queue.join(), timeout)
+        except asyncio.TimeoutError:
+            # Messages still waiting to be queued are counted by add_message when their wait times out
+            lost = sum(len(messages) for messages in self.unflushed.values()) - self.waiting_puts
+            self.messages_dropped += lost
+            logger.error(f"{lost} queued messages were not written within {timeout}s of shutdown")
+        self.writer.cancel()
+        self.writer = None
+    
+    def stats(self) -> Dict:
+        return {
+            "queued": self.write_queue.qsize() if self.write_queue else 0,
+            "unflushed": sum(len(messages) for messages in self.unflushed.values()),
+            "waiting_puts": self.waiting_puts,
+            "batches_written": self.batches_written,
+            "messages_written": self.messages_written,
+            "messages_dropped": self.messages_dropped,
+            "context_cache": self.context_cache.stats()
+        }
+    
+    async def _write_behind(self):
+        """Coalesce queued messages from all sessions into batched writes"""
+        while True:
+            batch = [await self.write_queue.get()]
+            try:
+                # Give other turns a moment to join the batch
+                await asyncio.sleep(DB_WRITE_INTERVAL)
+                while len(batch) < DB_WRITE_BATCH_SIZE and not self.write_queue.empty():
+                    batch.append(self.write_queue.get_nowait())
+                async with self.write_lock:
+                    # Skip messages of conversations deleted while they were queued
+                    live = [(session_id, entry) for session_id, entry in batch if self._is_unflushed(session_id, entry)]
+                    if live:
+                        await self._flush_batch(live)
+            finally:
+                for session_id, message_entry in batch:
+                    self._forget(session_id, message_entry)
+                    self.write_queue.task_done()
+    
+    async def _flush_batch(self, batch: List[Tuple[str, Dict]]):
+        remaining = batch
+        for attempt in range(DB_WRITE_ATTEMPTS):
+            try:
+                remaining = await self._write_batch(remaining)
+            except Exception as e:
+                logger.warning(f"Writing {len(remaining)} messages failed: {e}")
+            if not remaining:
+                self.batches_written += 1
+                self.messages_written += len(batch)
+                return
+            if attempt + 1 < DB_WRITE_ATTEMPTS:
+                await asyncio.sleep(0.5 * 2 ** attempt)
+        self.messages_dropped += len(remaining)
+        self.messages_written += len(batch) - len(remaining)
+        logger.error(f"Dropped {len(remaining)} messages after {DB_WRITE_ATTEMPTS} failed writes")
+    
+    async def _write_batch(self, batch: List[Tuple[str, Dict]]) -> List[Tuple[str, Dict]]:
+        """Write messages to their buckets with one bulk_write; returns the ones that failed"""
+        now = datetime.utcnow()
+        
+        # Reserve seqs in the session headers, one update per session; retried messages keep theirs
+        new_messages: Dict[str, List[Dict]] = {}
+        for session_id, message_entry in batch:
+            if "seq" not in message_entry:
+                new_messages.setdefault(session_id, []).append(message_entry)
+        
+        async def reserve(session_id: str, entries: List[Dict]):
+            conversation = await self.conversations.find_one_and_update(
+                {"session_id": session_id},
+                {
+                    "$inc": {"message_count": len(entries)},
+                    "$set": {"updated_at": now},
+                    "$setOnInsert": {"created_at": now}
+                },
+                projection={"message_count": 1},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            first = conversation["message_count"] - len(entries)
+            for offset, message_entry in enumerate(entries):
+                message_entry["seq"] = first + offset
+        
+        results = await asyncio.gather(
+            *(reserve(session_id, entries) for session_id, entries in new_messages.items()),
+            return_exceptions=True
+        )
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            logger.warning(f"Could not reserve message numbers for {len(errors)} sessions: {errors[0]}")
+        
+        # One $push per bucket, all in a single round trip. A bucket update is atomic and skips
+        # buckets already holding its messages, so retrying a write that did apply adds nothing
+        buckets: Dict[Tuple[str, int], List[Tuple[str, Dict]]] = {}
+        failed = []
+        for session_id, message_entry in batch:
+            if "seq" in message_entry:
+                buckets.setdefault((session_id, bucket_for(message_entry["seq"])), []).append((session_id, message_entry))
+            else:
+                failed.append((session_id, message_entry))
+        if not buckets:
+            return failed
+        
+        operations = [
+            UpdateOne(
+                {
+                    "session_id": session_id,
+                    "bucket_seq": bucket_seq,
+                    "messages.seq": {"$nin": [message_entry["seq"] for _, message_entry in entries]}
+                },
+                {
+                    "$push": {"messages": {"$each": [message_entry for _, message_entry in entries]}},
+                    "$set": {"updated_at": now},
+                    "$setOnInsert": {"created_at": now}
+                },
+                upsert=True
+            )
+            for (session_id, bucket_seq), entries in buckets.items()
+        ]
+        keys = list(buckets)
+        try:
+            await self.message_buckets.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            failed_indexes = set()
+            for error in e.details.get("writeErrors", []):
+                key = keys[error["index"]]
+                # The filter missed an existing bucket and the upsert hit the unique index:
+                # usually the bucket already holds these messages from an earlier attempt
+                if error.get("code") == DUPLICATE_KEY_ERROR and await self._bucket_has(key, buckets[key]):
+                    continue
+                failed_indexes.add(error["index"])
+            failed += [entry for index in sorted(failed_indexes) for entry in buckets[keys[index]]]
+            if failed_indexes:
+                logger.warning(f"{len(failed_indexes)} of {len(operations)} bucket writes failed: {e}")
+        except Exception:
+            # The write may or may not have applied; retrying it is safe either way
+            return batch
+        return failed
+    
+    async def _bucket_has(self, key: Tuple[str, int], entries: List[Tuple[str, Dict]]) -> bool:
+        session_id, bucket_seq = key
+        bucket = await self.message_buckets.find_one(
             {
-                "$push": {"messages": message_entry},
-                "$set": {"updated_at": datetime.utcnow()}
+                "session_id": session_id,
+                "bucket_seq": bucket_seq,
+                "messages.seq": {"$all": [message_entry["seq"] for _, message_entry in entries]}
             },
-            upsert=True
+            {"_id": 1}
         )
-        
-        logger.info(f"Added message to conversation {session_id}")
+        return bucket is not None
+    
+    def _drop(self, session_id: str, reason: str):
+        """Count a message that will never be written; the cached context no longer matches the database"""
+        self.messages_dropped += 1
+        self.context_cache.invalidate(session_id)
+        logger.error(f"Dropped a message for session {session_id}: {reason}")
+    
+    def _is_unflushed(self, session_id: str, message_entry: Dict) -> bool:
+        return any(entry is message_entry for entry in self.unflushed.get(session_id, []))
+    
+    def _forget(self, session_id: str, message_entry: Dict):
+        pending = self.unflushed.get(session_id)
+        if pending is None:
+            return
+        for index, entry in enumerate(pending):
+            if entry is message_entry:
+                del pending[index]
+                break
+        if not pending:
+            del self.unflushed[session_id]
     
     async def get_conversation_history(self, session_id: str, limit: int = 10) -> List[Dict]:
         """Get recent conversation history for context"""
+        cached = self.context_cache.get(session_id, limit)
+        if cached is not None:
+            return cached
+        
+        # Cold miss: read enough to fill the session's cache entry too
+        token = self.context_cache.read_token(session_id)
+        count = max(limit, CONTEXT_CACHE_TURNS)
+        messages = await self._read_history(session_id, count)
+        self.context_cache.fill(session_id, messages, len(messages) < count, token)
+        return messages[-limit:] if limit > 0 else []
+    
+    async def _read_history(self, session_id: str, limit: int) -> List[Dict]:
+        # Messages still waiting for the writer are newer than anything stored
+        pending = list(self.unflushed.get(session_id, []))
+        messages = []
+        if len(pending) < limit:
+            messages = await self._stored_history(session_id, limit)
+        stored = {message.get("seq") for message in messages}
+        messages += [entry for entry in pending if entry.get("seq") is None or entry["seq"] not in stored]
+        return messages[-limit:]
+    
+    async def _stored_history(self, session_id: str, limit: int) -> List[Dict]:
         conversation = await self.conversations.find_one(
             {"session_id": session_id},
             {"messages": {"$slice": -limit}}
         )
+        if not conversation:
+            return []
+        
+        # Sessions not yet migrated keep their older messages in the embedded array
+        legacy = conversation.get("messages")
+        bucket_filter = {"session_id": session_id}
+        if legacy is not None:
+            bucket_filter["bucket_seq"] = {"$gte": 0}  # migrated copies of the array, if any, are not live yet
         
-        if conversation and "messages" in conversation:
-            return conversation["messages"]
-        return []
+        # Walk back from the newest bucket until there are enough messages
+        messages = []
+        cursor = self.message_buckets.find(
+            bucket_filter,
+            {"_id": 0, "messages": {"$slice": -limit}}
+        ).sort("bucket_seq", -1).batch_size(2)
+        async for bucket in cursor:
+            messages[:0] = sorted(bucket["messages"], key=lambda message: message["seq"])
+            if len(messages) >= limit:
+                break
+        await cursor.close()
+        
+        if legacy:
+            messages[:0] = legacy
+        return messages
     
     async def get_conversation_context(self, session_id: str, context_limit: int = 5) -> str:
         """Get formatted conversation context for AI"""
@@ -88,18 +387,65 @@ class MongoDatabase:
         if not messages:
             return ""
         
-        context = "Previous conversation:\n"
+        lines = ["Previous conversation:"]
         for msg in messages:
-            context += f"User: {msg['user_message']}\n"
-            context += f"Assistant: {msg['ai_response']}\n"
+            lines.append(f"User: {msg['user_message']}")
+            lines.append(f"Assistant: {msg['ai_response']}")
+        
+        return "\n".join(lines) + "\n"
+    
+    async def migrate_conversation(self, session_id: str, attempts: int = 3) -> int:
+        """Move a legacy session's embedded messages into buckets; returns how many were moved
         
-        return context
+        Safe while the server is running: the copies get negative seqs, so they never collide
+        with new messages, and reads switch to them atomically when the array is removed.
+        """
+        for _ in range(attempts):
+            conversation = await self.conversations.find_one({"session_id": session_id}, {"messages": 1})
+            if not conversation or "messages" not in conversation:
+                return 0
+            legacy = conversation["messages"]
+            buckets: Dict[int, List[Dict]] = {}
+            for index, message in enumerate(legacy):
+                seq = index - len(legacy)
+                buckets.setdefault(bucket_for(seq), []).append(dict(message, seq=seq))
+            
+            now = datetime.utcnow()
+            for bucket_seq, messages in buckets.items():
+                # Replaced rather than appended to, so an interrupted migration can simply be rerun
+                await self.message_buckets.replace_one(
+                    {"session_id": session_id, "bucket_seq": bucket_seq},
+                    {
+                        "session_id": session_id,
+                        "bucket_seq": bucket_seq,
+                        "messages": messages,
+                        "created_at": messages[0].get("timestamp") or now,
+                        "updated_at": now
+                    },
+                    upsert=True
+                )
+            
+            # Only drop the array if nothing was appended to it in the meantime
+            result = await self.conversations.update_one(
+                {"_id": conversation["_id"], "messages": {"$size": len(legacy)}},
+                {"$unset": {"messages": ""}}
+            )
+            if result.modified_count:
+                self.context_cache.invalidate(session_id)
+                logger.info(f"Migrated {len(legacy)} messages of conversation {session_id} into {len(buckets)} buckets")
+                return len(legacy)
+        raise RuntimeError(f"Conversation {session_id} kept changing during migration")
     
     async def delete_conversation(self, session_id: str):
         """Delete a conversation"""
-        result = await self.conversations.delete_one({"session_id": session_id})
+        async with self.write_lock:
+            # Queued messages are skipped by the writer; a batch already being written finishes first
+            self.unflushed.pop(session_id, None)
+            self.context_cache.invalidate(session_id)
+            result = await self.conversations.delete_one({"session_id": session_id})
+            buckets = await self.message_buckets.delete_many({"session_id": session_id})
         logger.info(f"Deleted conversation {session_id}")
-        return result.deleted_count > 0
+        return result.deleted_count > 0 or buckets.deleted_count > 0
 
 # Global database instance
 db = MongoDatabase()
@@ -0,0 +1,76 @@
+"""
+Per-turn time budgets
+
+A deadline is started when a turn is received and stored in a context
+variable for the task that processes it, so every stage (transcription,
+context fetch, chat, database write, speech) can bound its wait by the time
+that is left instead of threading a timeout through each call. Tasks created
+while a turn runs inherit its deadline.
+"""
+import asyncio
+import contextvars
+import os
+import time
+from typing import Awaitable, Optional, TypeVar
+
+# Default time budget for a whole turn, in seconds; clients may ask for less
+TURN_DEADLINE = float(os.getenv("TURN_DEADLINE", "30"))
+
+# Shortest budget a client may request, in seconds
+MIN_TURN_DEADLINE = 1.0
+
+# Speech is skipped (text-only reply) when less than this many seconds are left
+MIN_TTS_BUDGET = float(os.getenv("MIN_TTS_BUDGET", "2"))
+
+T = TypeVar("T")
+
+class DeadlineExceeded(Exception):
+    """Raised when a turn's time budget runs out before a stage finishes"""
+
+class Deadline:
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+
+    @classmethod
+    def start(cls, requested: Optional[float] = None) -> "Deadline":
+        """Start a turn's budget, honouring a client-requested one within the server's limits"""
+        budget = TURN_DEADLINE
+        if requested is not None and requested > 0:
+            budget = min(TURN_DEADLINE, max(MIN_TURN_DEADLINE, requested))
+        return cls(budget)
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+_current: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar("turn_deadline", default=None)
+
+def set_deadline(deadline: Optional[Deadline]):
+    """Make `deadline` the budget for the current task and the tasks it creates"""
+    _current.set(deadline)
+
+def current_deadline() -> Optional[Deadline]:
+    return _current.get()
+
+def remaining() -> Optional[float]:
+    """Seconds left in the current turn, or None when there is no deadline"""
+    deadline = _current.get()
+    return deadline.remaining() if deadline else None
+
+async def within(awaitable: Awaitable[T]) -> T:
+    """Await `awaitable`, giving up with DeadlineExceeded when the current turn's budget runs out"""
+    budget = remaining()
+    if budget is None:
+        return await awaitable
+    if budget <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise DeadlineExceeded("Turn deadline exceeded")
+    try:
+        return await asyncio.wait_for(awaitable, budget)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(f"Turn deadline of {_current.get().budget:.1f}s exceeded") from None
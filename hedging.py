@@ -0,0 +1,157 @@
+"""
+Hedged requests for tail-latency reduction
+
+If an upstream call has not answered within a percentile of its recent
+latency, a duplicate is sent and whichever attempt finishes first wins; the
+other is cancelled. Hedges are capped by a budget (a fraction of primary
+requests) so a slow provider is not hit with twice the load.
+
+The scheduler runs the hedger inside an admitted slot, so latencies are the
+provider's alone (no queueing or retry backoff). A hedge never queues: it is
+only sent when the stage has a spare slot to give it right away.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+
+# Latency percentile after which a duplicate request is sent
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+
+# Hedges allowed per primary request, e.g. 0.1 = at most 10% extra requests
+HEDGE_BUDGET = float(os.getenv("HEDGE_BUDGET", "0.1"))
+
+# Latency samples needed before the percentile is trusted
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+
+# Never hedge earlier than this, in seconds
+HEDGE_MIN_DELAY = 0.05
+
+LATENCY_WINDOW = 500
+
+class LatencyTracker:
+    """Rolling window of recent request latencies"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.samples = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def stats(self) -> Dict:
+        def ms(p):
+            value = self.percentile(p)
+            return round(value * 1000, 1) if value is not None else None
+        return {"samples": len(self.samples), "p50_ms": ms(50), "p95_ms": ms(95), "p99_ms": ms(99)}
+
+class Hedger:
+    def __init__(self, enabled: bool = HEDGE_ENABLED, percentile: float = HEDGE_PERCENTILE,
+                 budget: float = HEDGE_BUDGET, min_samples: int = HEDGE_MIN_SAMPLES):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.trackers: Dict[str, LatencyTracker] = {}
+        self.tokens = 0.0
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def tracker(self, stage: str) -> LatencyTracker:
+        return self.trackers.setdefault(stage, LatencyTracker())
+
+    def hedge_delay(self, stage: str) -> Optional[float]:
+        """Seconds to wait before hedging, or None when hedging is off or there is too little data"""
+        tracker = self.tracker(stage)
+        if not self.enabled or len(tracker.samples) < self.min_samples:
+            return None
+        return max(HEDGE_MIN_DELAY, tracker.percentile(self.percentile))
+
+    async def run(self, stage: str, attempt: Callable[[], Awaitable[Any]],
+                  spare_slot: Tuple[Callable[[], bool], Callable[[], None]] = None) -> Any:
+        """Run `attempt`, sending a duplicate if it is slower than the stage's hedge delay
+
+        `spare_slot` is a (try_acquire, release) pair; the duplicate is only sent if try_acquire()
+        gets it a slot without waiting, and the slot is released once the hedge is over.
+        """
+        self.requests += 1
+        # Each primary request earns a fraction of a hedge, with a small burst allowance
+        self.tokens = min(self.tokens + self.budget, max(1.0, self.budget * 10))
+
+        delay = self.hedge_delay(stage)
+        primary = self._timed(stage, attempt)
+        if delay is None:
+            return await primary
+
+        attempts = {asyncio.ensure_future(primary)}
+        started = {task: time.monotonic() for task in attempts}
+        hedge = None
+        try:
+            done, _ = await asyncio.wait(attempts, timeout=delay)
+            if not done and self.tokens >= 1 and (spare_slot is None or spare_slot[0]()):
+                self.tokens -= 1
+                self.hedges += 1
+                logger.info(f"Hedging {stage} request after {delay * 1000:.0f} ms")
+                hedge = asyncio.ensure_future(self._timed(stage, attempt))
+                attempts.add(hedge)
+                started[hedge] = time.monotonic()
+
+            # Keep the first attempt that succeeds; fail only when every attempt has failed
+            error = None
+            pending = attempts
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedge_wins += 1
+                        self._record_losers(stage, pending, started)
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in attempts:
+                task.cancel()
+            if hedge is not None and spare_slot is not None:
+                spare_slot[1]()
+
+    async def _timed(self, stage: str, attempt: Callable[[], Awaitable[Any]]) -> Any:
+        started = time.monotonic()
+        result = await attempt()
+        self.tracker(stage).record(time.monotonic() - started)
+        return result
+
+    def _record_losers(self, stage: str, losers, started: Dict[asyncio.Future, float]):
+        """Record how long the attempts that lost the race had been running, a lower bound on their latency
+
+        Without these the window would keep only the fast side of every hedged race, and the
+        hedge delay would drift down.
+        """
+        now = time.monotonic()
+        for task in losers:
+            self.tracker(stage).record(now - started[task])
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "latency": {stage: tracker.stats() for stage, tracker in self.trackers.items()},
+        }
+
+# Global hedger instance
+hedger = Hedger()
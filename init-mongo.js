@@ -4,21 +4,31 @@
 // Create the voice_assistant database
 use('voice_assistant');
 
-// Create conversations collection with indexes
+// Create conversations (session headers) and message_buckets collections with indexes
 db.createCollection('conversations');
+db.createCollection('message_buckets');
 
 // Create indexes for better performance
 db.conversations.createIndex({ "session_id": 1 }, { unique: true });
 db.conversations.createIndex({ "created_at": 1 });
 db.conversations.createIndex({ "updated_at": 1 });
+db.message_buckets.createIndex({ "session_id": 1, "bucket_seq": 1 }, { unique: true });
 
 // Insert a sample conversation (optional)
 db.conversations.insertOne({
   session_id: "sample_session",
   created_at: new Date(),
   updated_at: new Date(),
+  message_count: 1
+});
+db.message_buckets.insertOne({
+  session_id: "sample_session",
+  bucket_seq: 0,
+  created_at: new Date(),
+  updated_at: new Date(),
   messages: [
     {
+      seq: 0,
       timestamp: new Date(),
       user_message: "Hello, how are you?",
       ai_response: "Hello! I'm doing well, thank you for asking. How can I help you today?",
@@ -29,5 +39,5 @@ db.conversations.insertOne({
 
 print("MongoDB initialization completed!");
 print("Database: voice_assistant");
-print("Collection: conversations");
-print("Indexes created for session_id, created_at, and updated_at");
\ No newline at end of file
+print("Collections: conversations, message_buckets");
+print("Indexes created for session_id, created_at, updated_at, and (session_id, bucket_seq)");
\ No newline at end of file
@@ -4,16 +4,31 @@ from fastapi.responses import HTMLResponse, Response
 from contextlib import asynccontextmanager
 import json
 import asyncio
-from openai import OpenAI
+from openai import AsyncOpenAI
+import httpx
 import os
 from dotenv import load_dotenv
-from typing import Dict, List
+from typing import AsyncIterator, Coroutine, Dict, List, Optional, Tuple
 import logging
-import tempfile
 import base64
 import io
 import uuid
+import hashlib
+import unicodedata
+from cache import TwoTierCache
+from circuit import CircuitOpenError
+from context_builder import CONTEXT_MAX_TURNS, build_messages
 from database import db
+from deadline import MIN_TTS_BUDGET, Deadline, DeadlineExceeded, remaining, set_deadline, within
+from hedging import hedger
+from prompts import prompts
+from scheduler import scheduler
+from sentences import SentenceSplitter
+from vad import VadResult, split_at_silence, trim_silence
+from webm import WebmError, is_webm, parse_webm
+from protocol import (
+    FLAG_TURN_END, FRAME_AUDIO_CHUNK, FRAME_AUDIO_CLIP, FRAME_TTS_AUDIO, FrameError, is_turn_id, iter_frames, unpack_frame,
+)
 
 # Load environment variables
 load_dotenv()
@@ -31,32 +46,74 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.error(f"Failed to connect to database: {e}")
     
+    # Render greetings, fillers and error replies now, in every negotiable format, so they play without an upstream call later
+    try:
+        synthesize = lambda text, audio_format: generate_speech(text, response_format=audio_format)
+        await asyncio.wait_for(prompts.load(synthesize, TTS_FORMATS), PROMPTS_LOAD_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning(f"Canned prompts not fully rendered after {PROMPTS_LOAD_TIMEOUT}s, continuing without them")
+    
     yield
     
     # Shutdown
     await db.disconnect()
     logger.info("Database disconnected")
+    if client:
+        await client.close()
+        logger.info("OpenAI client closed")
 
 app = FastAPI(title="Voice Assistant WebSocket Server", lifespan=lifespan)
 
 # Initialize OpenAI client
+# A single async client shares one pooled set of HTTP connections across all
+# sessions, so an upstream call never blocks the event loop for other sockets.
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+
+def create_openai_client(api_key: str, transport: httpx.AsyncBaseTransport = None) -> AsyncOpenAI:
+    """Create an async OpenAI client backed by a shared connection pool"""
+    http_client = httpx.AsyncClient(
+        transport=transport,
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_CONNECTIONS // 5 or 1,
+        ),
+        timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=5.0),
+    )
+    # Retries are left to the upstream scheduler so it sees every 429 and can back off
+    return AsyncOpenAI(api_key=api_key, http_client=http_client, max_retries=0)
+
 api_key = os.getenv("OPENAI_API_KEY")
 if not api_key:
     logger.warning("OPENAI_API_KEY not found in environment variables. Please set it in your .env file.")
     client = None
 else:
     try:
-        client = OpenAI(api_key=api_key)
+        client = create_openai_client(api_key)
         logger.info("OpenAI client initialized successfully")
     except Exception as e:
         logger.error(f"Failed to initialize OpenAI client: {e}")
         client = None
 
+# Turns a session may have waiting behind the one being processed
+TURN_QUEUE_SIZE = int(os.getenv("TURN_QUEUE_SIZE", "4"))
+
+# Seconds without reply audio before the "still thinking" prompt is played (0 disables it)
+THINKING_FILLER_DELAY = float(os.getenv("THINKING_FILLER_DELAY", "3"))
+
+# Longest startup wait for rendering the canned prompts
+PROMPTS_LOAD_TIMEOUT = 15
+
 # Store active WebSocket connections
 class ConnectionManager:
     def __init__(self):
         self.active_connections: List[WebSocket] = []
         self.client_sessions: Dict[WebSocket, str] = {}  # Track session IDs for each client
+        self.client_capabilities: Dict[WebSocket, Dict] = {}  # Features announced in the client's hello
+        self.audio_buffers: Dict[WebSocket, Dict[int, bytearray]] = {}  # In-progress upload by turn ID (at most one)
+        self.rejected_uploads: Dict[WebSocket, int] = {}  # Turn whose upload went over MAX_AUDIO_BYTES
+        self.turn_queues: Dict[WebSocket, asyncio.Queue] = {}  # Turns waiting for the session's worker
+        self.active_turns: Dict[WebSocket, Tuple[int, asyncio.Task]] = {}  # Turn currently being processed
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
@@ -64,59 +121,254 @@ class ConnectionManager:
         # Generate a unique session ID for this connection
         session_id = str(uuid.uuid4())
         self.client_sessions[websocket] = session_id
+        self.turn_queues[websocket] = asyncio.Queue(maxsize=TURN_QUEUE_SIZE)
         logger.info(f"Client connected with session {session_id}. Total connections: {len(self.active_connections)}")
         return session_id
 
     def disconnect(self, websocket: WebSocket):
         self.active_connections.remove(websocket)
         session_id = self.client_sessions.pop(websocket, None)
+        self.client_capabilities.pop(websocket, None)
+        self.audio_buffers.pop(websocket, None)
+        self.rejected_uploads.pop(websocket, None)
+        self.turn_queues.pop(websocket, None)
         logger.info(f"Client with session {session_id} disconnected. Total connections: {len(self.active_connections)}")
 
     async def send_personal_message(self, message: str, websocket: WebSocket):
         await websocket.send_text(message)
+
+    async def send_audio(self, audio: bytes, websocket: WebSocket, turn_id: int, seq: int = 0, final: bool = True):
+        """Send audio as binary frames tagged with the turn ID"""
+        for frame in iter_frames(FRAME_TTS_AUDIO, turn_id, audio, seq, final):
+            await websocket.send_bytes(frame)
+
+    def append_audio(self, websocket: WebSocket, turn_id: int, chunk) -> int:
+        """Append a slice to the turn's upload buffer and return the buffered size"""
+        if self.rejected_uploads.get(websocket, turn_id) != turn_id:
+            # A new upload ends the rejected one
+            del self.rejected_uploads[websocket]
+        buffers = self.audio_buffers.setdefault(websocket, {})
+        if turn_id not in buffers and buffers:
+            # One upload at a time per session, so buffered audio never exceeds MAX_AUDIO_BYTES:
+            # audio for a new turn supersedes an upload that was never finished
+            logger.info(f"Dropping unfinished uploads for turns {list(buffers)}")
+            buffers.clear()
+        buffer = buffers.setdefault(turn_id, bytearray())
+        buffer += chunk
+        return len(buffer)
+
+    def pop_audio(self, websocket: WebSocket, turn_id: int) -> bytes:
+        """Remove and return the buffered upload for a turn"""
+        buffer = self.audio_buffers.get(websocket, {}).pop(turn_id, None)
+        return bytes(buffer) if buffer else b""
+
+    def reject_audio(self, websocket: WebSocket, turn_id: int):
+        """Drop a turn's upload and ignore the rest of its chunks and its end marker"""
+        self.pop_audio(websocket, turn_id)
+        self.rejected_uploads[websocket] = turn_id
+
+    def upload_rejected(self, websocket: WebSocket, turn_id: int) -> bool:
+        return websocket in self.rejected_uploads and self.rejected_uploads[websocket] == turn_id
+
+    def set_capabilities(self, websocket: WebSocket, capabilities: Dict):
+        self.client_capabilities[websocket] = capabilities
+
+    def supports(self, websocket: WebSocket, capability: str) -> bool:
+        return bool(self.client_capabilities.get(websocket, {}).get(capability))
+    
+    def audio_format(self, websocket: WebSocket) -> str:
+        """TTS format negotiated in the client's hello"""
+        return self.client_capabilities.get(websocket, {}).get("audio_format", TTS_FORMAT)
     
+    def enqueue_turn(self, websocket: WebSocket, turn: Coroutine, turn_id: int = None) -> bool:
+        """Queue a turn for the session's worker; returns False when the queue is full"""
+        turn_queue = self.turn_queues.get(websocket)
+        if turn_queue is None:
+            return False
+        try:
+            turn_queue.put_nowait((turn_id, turn))
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    def cancel_turns(self, websocket: WebSocket, turn_id: Optional[int] = None) -> List[int]:
+        """Cancel the running and queued turns (or only `turn_id`) and return the cancelled turn IDs"""
+        cancelled = []
+        active = self.active_turns.get(websocket)
+        if active and (turn_id is None or active[0] == turn_id) and not active[1].done():
+            active[1].cancel()
+            cancelled.append(active[0])
+        
+        turn_queue = self.turn_queues.get(websocket)
+        if turn_queue is not None:
+            # Drain and re-queue the turns that survive so their order is kept
+            waiting = []
+            while not turn_queue.empty():
+                waiting.append(turn_queue.get_nowait())
+            for item in waiting:
+                if item is not None and (turn_id is None or item[0] == turn_id):
+                    item[1].close()
+                    cancelled.append(item[0])
+                else:
+                    turn_queue.put_nowait(item)
+        
+        # Half-uploaded clips of cancelled turns are never going to be processed
+        buffers = self.audio_buffers.get(websocket, {})
+        for upload_id in list(buffers):
+            if turn_id is None or upload_id == turn_id:
+                del buffers[upload_id]
+                if upload_id not in cancelled:
+                    cancelled.append(upload_id)
+        if turn_id is None or self.rejected_uploads.get(websocket) == turn_id:
+            self.rejected_uploads.pop(websocket, None)
+        return cancelled
+
     def get_session_id(self, websocket: WebSocket) -> str:
         return self.client_sessions.get(websocket, "unknown")
 
 manager = ConnectionManager()
 
-def transcribe_audio(audio_data: bytes) -> str:
-    """Transcribe audio using OpenAI Whisper"""
+# Largest clip accepted from a client (Whisper rejects uploads above 25 MB)
+MAX_AUDIO_BYTES = int(os.getenv("MAX_AUDIO_BYTES", str(25 * 1024 * 1024)))
+
+# WebM uploads larger than this are validated off the event loop
+WEBM_INLINE_PARSE_BYTES = 256 * 1024
+
+TRANSCRIPTION_MODEL = "whisper-1"
+
+# Byte-identical clips (client retries, replayed traffic) reuse an earlier transcription
+transcription_cache = TwoTierCache(
+    "transcription",
+    max_bytes=int(os.getenv("TRANSCRIPTION_CACHE_BYTES", str(4 * 1024 * 1024))),
+    directory=os.getenv("TRANSCRIPTION_CACHE_DIR"),
+    max_disk_bytes=int(os.getenv("TRANSCRIPTION_CACHE_DISK_BYTES", str(64 * 1024 * 1024)))
+)
+
+def transcription_cache_key(audio_data: bytes, model: str = TRANSCRIPTION_MODEL) -> str:
+    return f"{hashlib.blake2b(audio_data, digest_size=20).hexdigest()}-{model}"
+
+# Clips longer than this (seconds) are split at pauses and their chunks transcribed in parallel
+CHUNKED_TRANSCRIPTION_SECONDS = float(os.getenv("CHUNKED_TRANSCRIPTION_SECONDS", "45"))
+
+# Longest chunk sent to Whisper in one request when splitting
+TRANSCRIPTION_CHUNK_SECONDS = float(os.getenv("TRANSCRIPTION_CHUNK_SECONDS", "20"))
+
+# Chunks of one clip transcribed at the same time
+TRANSCRIPTION_FAN_OUT = int(os.getenv("TRANSCRIPTION_FAN_OUT", "4"))
+
+# Replies sent straight away while a stage's circuit breaker is open
+UNAVAILABLE_MESSAGES = {
+    "stt": prompts.text("stt_unavailable"),
+    "chat": prompts.text("chat_unavailable"),
+}
+
+# Reply sent when a turn runs out of time before an answer is ready
+DEADLINE_MESSAGE = prompts.text("deadline")
+
+def clip_duration(audio_data: bytes) -> float:
+    """Duration of a WebM clip in seconds, or 0 when it cannot be parsed (Whisper gets it as it is)"""
+    if not is_webm(audio_data):
+        return 0.0
+    try:
+        return parse_webm(audio_data, max_seconds=0).duration
+    except WebmError:
+        return 0.0
+
+async def transcribe_clip(audio_data: bytes, session_id: str = None) -> str:
+    """Send one clip to Whisper and return the text; errors are raised"""
+    # Upload straight from memory: the clip is sent as a (filename, bytes) multipart field, so no temp
+    # file is written and every attempt (retry or hedge) reuses the same buffer
+    transcript = await scheduler.call("stt", session_id, lambda: client.audio.transcriptions.create(
+        model=TRANSCRIPTION_MODEL,
+        file=("audio.webm", audio_data)
+    ), hedge=True)
+    return transcript.text.strip()
+
+async def transcribe_chunks(chunks: List[bytes], session_id: str = None) -> List[str]:
+    """Transcribe consecutive chunks of a clip, at most TRANSCRIPTION_FAN_OUT at a time, in their original order"""
+    fan_out = asyncio.Semaphore(TRANSCRIPTION_FAN_OUT)
+    
+    async def transcribe_chunk(chunk: bytes) -> str:
+        async with fan_out:
+            return await transcribe_clip(chunk, session_id)
+    
+    tasks = [asyncio.create_task(transcribe_chunk(chunk)) for chunk in chunks]
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        # One failed chunk fails the clip - stop transcribing the rest
+        for task in tasks:
+            task.cancel()
+
+async def transcribe_audio(audio_data: bytes, session_id: str = None, vad: VadResult = None) -> str:
+    """Transcribe audio using OpenAI Whisper
+
+    `vad` is trim_silence's result for the clip, whose duration and frame energies spare parsing
+    and decoding it again when deciding whether and where to split it.
+    """
     if not client:
         logger.warning("OpenAI client not available - API key may be missing or invalid")
         return "I'm sorry, the speech recognition service is not available right now."
     
     try:
-        # Create a temporary file with the audio data
-        with tempfile.NamedTemporaryFile(suffix=".webm", delete=False) as temp_file:
-            temp_file.write(audio_data)
-            temp_file_path = temp_file.name
+        cache_key = transcription_cache_key(audio_data)
+        cached = await transcription_cache.get(cache_key)
+        if cached is not None:
+            logger.info("Transcription served from cache")
+            return cached.decode("utf-8")
         
         logger.info("Transcribing audio with Whisper...")
         
-        # Open the temporary file and send to Whisper
-        with open(temp_file_path, "rb") as audio_file:
-            transcript = client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file
-            )
+        chunks = [audio_data]
+        duration = vad.kept if vad else None
+        if duration is None:
+            if len(audio_data) > WEBM_INLINE_PARSE_BYTES:
+                duration = await asyncio.to_thread(clip_duration, audio_data)
+            else:
+                duration = clip_duration(audio_data)
+        if duration > CHUNKED_TRANSCRIPTION_SECONDS and is_webm(audio_data):
+            energy_db = vad.energy_db if vad else None
+            try:
+                chunks = await asyncio.to_thread(split_at_silence, audio_data, TRANSCRIPTION_CHUNK_SECONDS, energy_db)
+            except WebmError as e:
+                logger.warning(f"Could not split long clip, transcribing it whole: {e}")
         
-        # Clean up temporary file
-        os.unlink(temp_file_path)
+        if len(chunks) == 1:
+            transcribed_text = await transcribe_clip(audio_data, session_id)
+        else:
+            logger.info(f"Transcribing long clip as {len(chunks)} chunks in parallel")
+            transcribed_text = " ".join(text for text in await transcribe_chunks(chunks, session_id) if text)
         
-        transcribed_text = transcript.text.strip()
         logger.info(f"Transcription result: {transcribed_text[:50]}...")
+        await transcription_cache.put(cache_key, transcribed_text.encode("utf-8"))
         return transcribed_text
         
+    except CircuitOpenError as e:
+        logger.warning(f"Skipping transcription: {str(e)}")
+        return UNAVAILABLE_MESSAGES["stt"]
+    except DeadlineExceeded as e:
+        logger.warning(f"Transcription timed out: {str(e)}")
+        return DEADLINE_MESSAGE
     except Exception as e:
         logger.error(f"Error transcribing audio: {str(e)}")
-        # Clean up temporary file if it exists
-        try:
-            os.unlink(temp_file_path)
-        except:
-            pass
         return f"I'm sorry, I couldn't understand the audio: {str(e)}"
 
+SYSTEM_PROMPT = "You are a helpful voice assistant. Keep your responses concise and conversational, as they will be spoken aloud. Limit responses to 2-3 sentences maximum. Remember previous conversations to provide contextual responses."
+
+async def build_chat_messages(user_message: str, session_id: str = None) -> List[Dict]:
+    """Build the chat completion messages: system prompt, conversation context and the user message"""
+    history = []
+    
+    # Add conversation history if session_id is provided
+    if session_id:
+        try:
+            history = await within(db.get_conversation_history(session_id, CONTEXT_MAX_TURNS))
+        except Exception as e:
+            logger.warning(f"Could not retrieve conversation context: {e}")
+    
+    # As many previous turns as fit the token budget, as user/assistant messages
+    return build_messages(SYSTEM_PROMPT, history, user_message)
+
 async def get_ai_response_async(user_message: str, session_id: str = None) -> str:
     """Get response from OpenAI GPT model with conversation context - async version"""
     if not client:
@@ -126,174 +378,692 @@ async def get_ai_response_async(user_message: str, session_id: str = None) -> st
     try:
         logger.info(f"Sending request to OpenAI for message: {user_message[:50]}...")
         
-        # Build messages array with system prompt
-        messages = [
-            {
-                "role": "system", 
-                "content": "You are a helpful voice assistant. Keep your responses concise and conversational, as they will be spoken aloud. Limit responses to 2-3 sentences maximum. Remember previous conversations to provide contextual responses."
-            }
-        ]
-        
-        # Add conversation history if session_id is provided
-        if session_id:
-            try:
-                context = await db.get_conversation_context(session_id, 3)
-                if context:
-                    messages.append({"role": "system", "content": context})
-            except Exception as e:
-                logger.warning(f"Could not retrieve conversation context: {e}")
-        
-        # Add current user message
-        messages.append({"role": "user", "content": user_message})
+        messages = await build_chat_messages(user_message, session_id)
         
-        response = client.chat.completions.create(
+        response = await scheduler.call("chat", session_id, lambda: client.chat.completions.create(
             model="gpt-3.5-turbo",
             messages=messages,
             max_tokens=150,
             temperature=0.7
-        )
+        ))
         ai_message = response.choices[0].message.content.strip()
         logger.info(f"Received AI response: {ai_message[:50]}...")
         return ai_message
+    except CircuitOpenError as e:
+        logger.warning(f"Skipping AI response: {str(e)}")
+        return UNAVAILABLE_MESSAGES["chat"]
+    except DeadlineExceeded as e:
+        logger.warning(f"AI response timed out: {str(e)}")
+        return DEADLINE_MESSAGE
     except Exception as e:
         logger.error(f"Error getting AI response: {str(e)}")
         return f"I'm sorry, I encountered an error: {str(e)}"
 
-def generate_speech(text: str) -> bytes:
+async def stream_ai_response(user_message: str, session_id: str = None) -> AsyncIterator[str]:
+    """Stream the AI response as text deltas while the completion is generated"""
+    if not client:
+        logger.warning("OpenAI client not available - API key may be missing or invalid")
+        yield "I'm sorry, the AI service is not available right now. Please check that your OpenAI API key is configured correctly."
+        return
+    
+    received = False
+    try:
+        logger.info(f"Streaming request to OpenAI for message: {user_message[:50]}...")
+        
+        messages = await build_chat_messages(user_message, session_id)
+        
+        # The chat slot is held until the whole reply has been streamed
+        async with scheduler.hold("chat", session_id, lambda: client.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=messages,
+            max_tokens=150,
+            temperature=0.7,
+            stream=True
+        )) as stream:
+            # Closing the stream releases the connection if the turn is cancelled mid-reply
+            async with stream:
+                chunks = stream.__aiter__()
+                while True:
+                    # Each read gets the rest of the budget, so a stalled stream ends the reply
+                    # with what has been generated so far instead of waiting for the read timeout
+                    try:
+                        chunk = await within(chunks.__anext__())
+                    except StopAsyncIteration:
+                        break
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        received = True
+                        yield delta
+    except CircuitOpenError as e:
+        logger.warning(f"Skipping AI response: {str(e)}")
+        yield UNAVAILABLE_MESSAGES["chat"]
+    except DeadlineExceeded as e:
+        logger.warning(f"AI response timed out: {str(e)}")
+        if not received:
+            yield DEADLINE_MESSAGE
+    except Exception as e:
+        logger.error(f"Error streaming AI response: {str(e)}")
+        if not received:
+            yield f"I'm sorry, I encountered an error: {str(e)}"
+
+TTS_MODEL = "tts-1"
+TTS_VOICE = os.getenv("TTS_VOICE", "nova")  # Available voices: alloy, echo, fable, onyx, nova, shimmer
+TTS_FORMAT = "mp3"  # for clients that do not negotiate a format
+
+# Formats a client may negotiate in hello, in the server's order of preference. Opus is several
+# times smaller than MP3 at speech bitrates; PCM (24 kHz 16-bit mono) needs no decoding at all.
+SUPPORTED_TTS_FORMATS = ("opus", "aac", "mp3", "flac", "wav", "pcm")
+TTS_FORMATS = [f.strip() for f in os.getenv("TTS_FORMATS", "opus,aac,pcm,mp3").split(",") if f.strip() in SUPPORTED_TTS_FORMATS]
+if TTS_FORMAT not in TTS_FORMATS:
+    TTS_FORMATS.append(TTS_FORMAT)
+
+def negotiate_audio_format(accepted) -> str:
+    """The most preferred of TTS_FORMATS that the client says it can play, else MP3"""
+    if isinstance(accepted, list):
+        for audio_format in TTS_FORMATS:
+            if audio_format in accepted:
+                return audio_format
+    return TTS_FORMAT
+
+# Repeated phrases (acknowledgements, error messages) are synthesized once
+speech_cache = TwoTierCache(
+    "tts",
+    max_bytes=int(os.getenv("TTS_CACHE_BYTES", str(32 * 1024 * 1024))),
+    directory=os.getenv("TTS_CACHE_DIR"),
+    max_disk_bytes=int(os.getenv("TTS_CACHE_DISK_BYTES", str(512 * 1024 * 1024)))
+)
+
+def normalize_speech_text(text: str) -> str:
+    """Canonical form of a TTS input, so trivially different strings share a cache entry"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+def speech_cache_key(text: str, voice: str = TTS_VOICE, model: str = TTS_MODEL, response_format: str = TTS_FORMAT) -> str:
+    key = "\0".join((normalize_speech_text(text), voice, model, response_format))
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=20).hexdigest()
+
+async def generate_speech(text: str, session_id: str = None, response_format: str = TTS_FORMAT) -> bytes:
     """Generate speech from text using OpenAI TTS"""
+    canned = prompts.audio_for_text(text, response_format)
+    if canned:
+        return canned
+    
+    cache_key = speech_cache_key(text, response_format=response_format)
+    cached = await speech_cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"Speech served from cache for text: {text[:50]}...")
+        return cached
+    
     if not client:
         logger.warning("OpenAI client not available - API key may be missing or invalid")
         return b""
     
+    budget = remaining()
+    if budget is not None and budget < MIN_TTS_BUDGET:
+        # Not enough time left to synthesize - the reply goes out as text only
+        logger.warning(f"Skipping speech generation: {budget:.1f}s left in the turn")
+        return b""
+    
     try:
         logger.info(f"Generating speech for text: {text[:50]}...")
         
-        response = client.audio.speech.create(
-            model="tts-1",
-            voice="nova",  # Available voices: alloy, echo, fable, onyx, nova, shimmer
-            input=text
-        )
+        response = await scheduler.call("tts", session_id, lambda: client.audio.speech.create(
+            model=TTS_MODEL,
+            voice=TTS_VOICE,
+            input=normalize_speech_text(text),
+            response_format=response_format
+        ), hedge=True)
         
         logger.info("Speech generation completed")
+        if response.content:
+            await speech_cache.put(cache_key, response.content)
         return response.content
         
+    except (CircuitOpenError, DeadlineExceeded) as e:
+        # Deliver the reply as text only rather than waiting on a provider that is down or slow
+        logger.warning(f"Skipping speech generation: {str(e)}")
+        return b""
     except Exception as e:
         logger.error(f"Error generating speech: {str(e)}")
         return b""
 
+async def send_ai_response(websocket: WebSocket, session_id: str, ai_response: str, speech_data: bytes,
+                           turn_id: int = None, transcription: str = None):
+    """Send the AI response text, followed by its audio as binary frames when the client supports them"""
+    binary_audio = manager.supports(websocket, "binary_audio") and bool(speech_data)
+    response = {
+        "type": "ai_response",
+        "message": ai_response,
+        "session_id": session_id,
+        "timestamp": asyncio.get_event_loop().time()
+    }
+    if transcription is not None:
+        response["transcription"] = transcription
+    if binary_audio:
+        # Audio follows as FRAME_TTS_AUDIO frames tagged with the same turn ID
+        response["audio"] = ""
+        response["audio_frames"] = True
+    else:
+        response["audio"] = base64.b64encode(speech_data).decode('utf-8') if speech_data else ""
+    if turn_id is not None:
+        response["turn_id"] = turn_id
+    await manager.send_personal_message(json.dumps(response), websocket)
+    
+    if binary_audio:
+        await manager.send_audio(speech_data, websocket, turn_id or 0)
+
+async def send_ai_audio(websocket: WebSocket, session_id: str, speech_data: bytes, turn_id: int = None,
+                        final: bool = True):
+    """Send the audio for an already delivered text response"""
+    if not speech_data:
+        return
+    if manager.supports(websocket, "binary_audio"):
+        await manager.send_audio(speech_data, websocket, turn_id or 0, final=final)
+        return
+    response = {
+        "type": "ai_audio",
+        "audio": base64.b64encode(speech_data).decode('utf-8'),
+        "session_id": session_id
+    }
+    if turn_id is not None:
+        response["turn_id"] = turn_id
+    await manager.send_personal_message(json.dumps(response), websocket)
+
+class ThinkingFiller:
+    """Plays the pre-rendered "still thinking" prompt if a reply's audio is slow to start"""
+    
+    def __init__(self, websocket: WebSocket, session_id: str, turn_id: int = None):
+        self.playing = False
+        self.task = None
+        audio = prompts.audio("thinking", manager.audio_format(websocket))
+        if THINKING_FILLER_DELAY > 0 and audio:
+            self.task = asyncio.create_task(self._play(websocket, session_id, turn_id, audio))
+    
+    async def _play(self, websocket: WebSocket, session_id: str, turn_id: int, audio: bytes):
+        await asyncio.sleep(THINKING_FILLER_DELAY)
+        self.playing = True
+        await send_ai_audio(websocket, session_id, audio, turn_id, final=False)
+    
+    async def stop(self) -> bool:
+        """Call before sending the reply's audio; returns whether the filler was played"""
+        if self.task is None:
+            return False
+        if not self.playing:
+            self.task.cancel()
+            return False
+        # Let a filler that is already being sent finish, so its frames don't interleave with the reply's
+        try:
+            await self.task
+        except Exception as e:
+            logger.warning(f"Could not send thinking filler: {e}")
+        return True
+    
+    def cancel(self):
+        if self.task is not None:
+            self.task.cancel()
+
+class SentenceSpeaker:
+    """Synthesizes each sentence as soon as it is complete and sends the audio segments in order"""
+    
+    def __init__(self, websocket: WebSocket, session_id: str, turn_id: int, filler: ThinkingFiller = None):
+        self.filler = filler
+        self.websocket = websocket
+        self.session_id = session_id
+        self.turn_id = turn_id
+        self.audio_format = manager.audio_format(websocket)
+        self.splitter = SentenceSplitter()
+        self.segments: asyncio.Queue = asyncio.Queue()
+        self.sender = asyncio.create_task(self._send_segments())
+        self.fed = False
+        self.canned = False
+    
+    def feed(self, delta: str):
+        if not self.fed:
+            self.fed = True
+            # Canned replies (outage, deadline) arrive as a single delta; play their pre-rendered
+            # audio whole rather than synthesizing the sentences live
+            audio = prompts.audio_for_text(delta, self.audio_format)
+            if audio:
+                self.canned = True
+                self._play(audio)
+                return
+        if self.canned:
+            return
+        for sentence in self.splitter.feed(delta):
+            self._speak(sentence)
+    
+    async def finish(self):
+        """Synthesize the trailing text and wait until every segment has been sent"""
+        remainder = self.splitter.flush()
+        if remainder:
+            self._speak(remainder)
+        self.segments.put_nowait(None)
+        await self.sender
+    
+    def cancel(self):
+        """Stop sending and abandon any synthesis still in flight"""
+        self.sender.cancel()
+        while not self.segments.empty():
+            task = self.segments.get_nowait()
+            if task is not None:
+                task.cancel()
+    
+    def _speak(self, sentence: str):
+        # TTS requests run concurrently; the sender awaits them in sentence order
+        self.segments.put_nowait(asyncio.create_task(generate_speech(sentence, self.session_id, self.audio_format)))
+    
+    def _play(self, audio: bytes):
+        segment = asyncio.get_running_loop().create_future()
+        segment.set_result(audio)
+        self.segments.put_nowait(segment)
+    
+    async def _send_segments(self):
+        seq = 0
+        filler_checked = self.filler is None
+        while True:
+            task = await self.segments.get()
+            if task is None:
+                break
+            speech_data = await task
+            if speech_data:
+                if not filler_checked:
+                    filler_checked = True
+                    if await self.filler.stop():
+                        seq = 1  # the filler was segment 0
+                await manager.send_audio(speech_data, self.websocket, self.turn_id, seq, final=False)
+                seq += 1
+        if not filler_checked and await self.filler.stop():
+            seq = 1
+        # Header-only frame marking the end of the turn's audio
+        await manager.send_audio(b"", self.websocket, self.turn_id, seq, final=True)
+
+async def stream_reply(websocket: WebSocket, session_id: str, user_message: str, turn_id: int = None,
+                       transcription: str = None, speaker: SentenceSpeaker = None) -> str:
+    """Forward completion deltas to the client as they arrive and return the full reply"""
+    def tagged(message: Dict) -> str:
+        message["session_id"] = session_id
+        if turn_id is not None:
+            message["turn_id"] = turn_id
+        return json.dumps(message)
+    
+    if transcription is not None:
+        await manager.send_personal_message(tagged({"type": "transcription", "transcription": transcription}), websocket)
+    
+    parts = []
+    deltas = stream_ai_response(user_message, session_id)
+    try:
+        async for delta in deltas:
+            parts.append(delta)
+            await manager.send_personal_message(tagged({"type": "ai_delta", "delta": delta}), websocket)
+            if speaker:
+                speaker.feed(delta)
+    finally:
+        # Release the chat slot right away, even if sending failed or the turn was cancelled
+        await deltas.aclose()
+    ai_response = "".join(parts).strip()
+    
+    done = {
+        "type": "ai_done",
+        "message": ai_response,
+        "timestamp": asyncio.get_event_loop().time()
+    }
+    if transcription is not None:
+        done["transcription"] = transcription
+    await manager.send_personal_message(tagged(done), websocket)
+    return ai_response
+
+async def save_exchange(session_id: str, user_message: str, ai_response: str, transcription: str = None):
+    """Save conversation to database"""
+    try:
+        # Normally this only queues the write; shielded so one held up by a full write queue
+        # still completes in the background when the turn's budget runs out
+        await within(asyncio.shield(db.add_message(session_id, user_message, ai_response, transcription)))
+    except DeadlineExceeded:
+        logger.warning(f"Saving conversation for session {session_id} continues past the turn deadline")
+    except Exception as e:
+        logger.error(f"Error saving conversation to database: {e}")
+
+async def respond_to_user(websocket: WebSocket, session_id: str, user_message: str,
+                          turn_id: int = None, transcription: str = None):
+    """Generate, store and deliver the AI response to a user message"""
+    streaming = manager.supports(websocket, "stream_text")
+    filler = ThinkingFiller(websocket, session_id, turn_id)
+    
+    if streaming and manager.supports(websocket, "binary_audio"):
+        # Speak each sentence while the rest of the reply is still being generated
+        speaker = SentenceSpeaker(websocket, session_id, turn_id or 0, filler)
+        try:
+            ai_response = await stream_reply(websocket, session_id, user_message, turn_id, transcription, speaker)
+            await save_exchange(session_id, user_message, ai_response, transcription)
+            await speaker.finish()
+        finally:
+            speaker.cancel()
+            filler.cancel()
+        return
+    
+    try:
+        # Get AI response with conversation context
+        if streaming:
+            ai_response = await stream_reply(websocket, session_id, user_message, turn_id, transcription)
+        else:
+            ai_response = await get_ai_response_async(user_message, session_id)
+        
+        await save_exchange(session_id, user_message, ai_response, transcription)
+        
+        # Generate speech for the response
+        speech_data = await generate_speech(ai_response, session_id, manager.audio_format(websocket))
+        await filler.stop()
+    finally:
+        filler.cancel()
+    
+    # Send response back to client
+    if streaming:
+        await send_ai_audio(websocket, session_id, speech_data, turn_id)
+    else:
+        await send_ai_response(websocket, session_id, ai_response, speech_data, turn_id, transcription)
+
+async def reject_if_unavailable(websocket: WebSocket, session_id: str, stages: Tuple[str, ...],
+                                turn_id: int = None) -> bool:
+    """Send the pre-rendered error for the first stage whose circuit is open; returns whether one was sent"""
+    for stage in stages:
+        if scheduler.is_open(stage):
+            await send_error(websocket, session_id, UNAVAILABLE_MESSAGES[stage], turn_id, "stt_unavailable" if stage == "stt" else "chat_unavailable")
+            return True
+    return False
+
+async def process_audio_turn(websocket: WebSocket, session_id: str, audio_data: bytes, turn_id: int = None,
+                             deadline: Deadline = None):
+    """Run one recorded clip through transcription, the AI response and speech synthesis"""
+    set_deadline(deadline)
+    if await reject_if_unavailable(websocket, session_id, ("stt", "chat"), turn_id):
+        return
+    try:
+        # Drop leading/trailing silence, and skip Whisper entirely when nobody spoke
+        vad = await asyncio.to_thread(trim_silence, audio_data)
+        if not vad.speech:
+            await send_error(websocket, session_id, prompts.text("no_speech"), turn_id, "no_speech")
+            return
+        
+        # Transcribe audio using Whisper
+        transcribed_text = await transcribe_audio(vad.audio, session_id, vad)
+        
+        if transcribed_text and not transcribed_text.startswith("I'm sorry"):
+            await respond_to_user(websocket, session_id, transcribed_text, turn_id, transcribed_text)
+            return
+        else:
+            # Error in transcription
+            response = {
+                "type": "error",
+                "message": transcribed_text,
+                "session_id": session_id,
+                "timestamp": asyncio.get_event_loop().time()
+            }
+        
+    except Exception as e:
+        logger.error(f"Error processing audio: {str(e)}")
+        response = {
+            "type": "error",
+            "message": f"Error processing audio: {str(e)}",
+            "session_id": session_id
+        }
+    
+    if turn_id is not None:
+        response["turn_id"] = turn_id
+    await manager.send_personal_message(json.dumps(response), websocket)
+    # Speak the matching canned prompt, or a generic one for unexpected errors
+    audio_format = manager.audio_format(websocket)
+    prompt_audio = prompts.audio_for_text(response["message"], audio_format) or prompts.audio("transcription_failed", audio_format)
+    await send_ai_audio(websocket, session_id, prompt_audio, turn_id)
+
+async def process_text_turn(websocket: WebSocket, session_id: str, user_message: str, turn_id: int = None,
+                            deadline: Deadline = None):
+    """Answer a text message with an AI response and synthesized speech"""
+    set_deadline(deadline)
+    if await reject_if_unavailable(websocket, session_id, ("chat",), turn_id):
+        return
+    await respond_to_user(websocket, session_id, user_message, turn_id)
+
+async def send_error(websocket: WebSocket, session_id: str, message: str, turn_id: int = None, prompt: str = None):
+    """Send an error message to the client, followed by the named canned prompt's audio if it is rendered"""
+    error_response = {
+        "type": "error",
+        "message": message,
+        "session_id": session_id
+    }
+    if turn_id is not None:
+        error_response["turn_id"] = turn_id
+    await manager.send_personal_message(json.dumps(error_response), websocket)
+    if prompt:
+        await send_ai_audio(websocket, session_id, prompts.audio(prompt, manager.audio_format(websocket)), turn_id)
+
+async def buffer_audio_chunk(websocket: WebSocket, session_id: str, turn_id: int, chunk):
+    """Append an uploaded slice to the session's buffer for the turn"""
+    if manager.upload_rejected(websocket, turn_id):
+        return
+    if manager.append_audio(websocket, turn_id, chunk) > MAX_AUDIO_BYTES:
+        manager.reject_audio(websocket, turn_id)
+        await send_error(websocket, session_id, "Audio clip is too large", turn_id)
+
+async def validate_audio(websocket: WebSocket, session_id: str, audio_data: bytes, turn_id: int = None) -> bool:
+    """Reject malformed, truncated or over-long WebM uploads before they are queued"""
+    if not is_webm(audio_data):
+        return True  # other containers go to Whisper as they are
+    try:
+        if len(audio_data) > WEBM_INLINE_PARSE_BYTES:
+            # Keep the reader's event loop free while a large upload is walked
+            await asyncio.to_thread(parse_webm, audio_data)
+        else:
+            parse_webm(audio_data)
+    except WebmError as e:
+        await send_error(websocket, session_id, f"Invalid audio: {str(e)}", turn_id)
+        return False
+    return True
+
+async def finish_audio_upload(websocket: WebSocket, session_id: str, turn_id: int, deadline_ms=None):
+    """Start processing a streamed upload once its end marker arrives"""
+    if manager.upload_rejected(websocket, turn_id):
+        return  # already answered with "Audio clip is too large"
+    audio_data = manager.pop_audio(websocket, turn_id)
+    if not audio_data:
+        await send_error(websocket, session_id, "No audio received", turn_id)
+        return
+    if not await validate_audio(websocket, session_id, audio_data, turn_id):
+        return
+    deadline = start_deadline(websocket, deadline_ms)
+    await enqueue_turn(websocket, session_id, process_audio_turn(websocket, session_id, audio_data, turn_id, deadline), turn_id)
+
+def start_deadline(websocket: WebSocket, deadline_ms=None) -> Deadline:
+    """Start a turn's time budget from the message's deadline_ms, else the one the client sent in hello"""
+    if deadline_ms is None:
+        deadline_ms = manager.client_capabilities.get(websocket, {}).get("deadline_ms")
+    try:
+        return Deadline.start(float(deadline_ms) / 1000 if deadline_ms is not None else None)
+    except (TypeError, ValueError):
+        return Deadline.start()
+
+async def enqueue_turn(websocket: WebSocket, session_id: str, turn: Coroutine, turn_id: int = None):
+    """Hand a turn to the session's worker, rejecting it if too many are already waiting"""
+    if not manager.enqueue_turn(websocket, turn, turn_id):
+        turn.close()
+        await send_error(websocket, session_id, prompts.text("busy"), turn_id, "busy")
+
+async def turn_worker(websocket: WebSocket, turn_queue: asyncio.Queue):
+    """Process a session's turns one at a time, in the order they arrived"""
+    while True:
+        item = await turn_queue.get()
+        if item is None:
+            break
+        turn_id, turn = item
+        
+        # Each turn runs as its own task so a cancel can abort it, including its upstream requests
+        task = asyncio.create_task(turn)
+        manager.active_turns[websocket] = (turn_id, task)
+        try:
+            await asyncio.wait([task])
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        finally:
+            manager.active_turns.pop(websocket, None)
+        
+        if task.cancelled():
+            logger.info(f"Turn {turn_id} cancelled")
+        elif task.exception():
+            logger.error(f"Error processing turn: {str(task.exception())}")
+
+async def handle_text_frame(websocket: WebSocket, session_id: str, data: str):
+    """Dispatch a JSON control or legacy message"""
+    logger.info(f"Received message type: {data[:100]}...")
+    
+    try:
+        message_data = json.loads(data)
+    except json.JSONDecodeError:
+        await send_error(websocket, session_id, "Invalid JSON format")
+        return
+    if not isinstance(message_data, dict):
+        await send_error(websocket, session_id, "Invalid message: expected a JSON object")
+        return
+    
+    message_type = message_data.get("type")
+    turn_id = message_data.get("turn_id")
+    if turn_id is not None and not is_turn_id(turn_id):
+        await send_error(websocket, session_id, "Invalid turn_id: expected an integer from 0 to 4294967295")
+        return
+    deadline_ms = message_data.get("deadline_ms")
+    
+    if message_type == "audio_data":
+        # Handle base64 audio data for transcription (legacy JSON path)
+        audio_base64 = message_data.get("audio", "")
+        if audio_base64:
+            try:
+                audio_data = base64.b64decode(audio_base64)
+            except (ValueError, TypeError) as e:
+                await send_error(websocket, session_id, f"Error processing audio: {str(e)}", turn_id)
+                return
+            if not await validate_audio(websocket, session_id, audio_data, turn_id):
+                return
+            deadline = start_deadline(websocket, deadline_ms)
+            await enqueue_turn(websocket, session_id, process_audio_turn(websocket, session_id, audio_data, turn_id, deadline), turn_id)
+    
+    elif message_type == "audio_chunk":
+        # One base64 slice of a clip that is still being recorded
+        try:
+            chunk = base64.b64decode(message_data.get("audio", ""))
+        except (ValueError, TypeError) as e:
+            # Later chunks would start a new, headerless clip
+            manager.reject_audio(websocket, turn_id)
+            await send_error(websocket, session_id, f"Error processing audio: {str(e)}", turn_id)
+            return
+        await buffer_audio_chunk(websocket, session_id, turn_id, chunk)
+    
+    elif message_type == "audio_end":
+        # The clip is complete - transcribe everything uploaded so far
+        await finish_audio_upload(websocket, session_id, turn_id, deadline_ms)
+    
+    elif message_type == "voice_message":
+        # Handle text message (for backward compatibility)
+        user_message = message_data.get("message", "")
+        if user_message:
+            deadline = start_deadline(websocket, deadline_ms)
+            await enqueue_turn(websocket, session_id, process_text_turn(websocket, session_id, user_message, turn_id, deadline), turn_id)
+    
+    elif message_type == "hello":
+        # Client announces the protocol features it supports
+        capabilities = message_data.get("capabilities") or {}
+        if not isinstance(capabilities, dict):
+            await send_error(websocket, session_id, "Invalid hello: capabilities must be an object")
+            capabilities = {}
+        # Pick the TTS format for this connection from the ones the client can play
+        capabilities["audio_format"] = negotiate_audio_format(capabilities.get("audio_formats"))
+        manager.set_capabilities(websocket, capabilities)
+        hello_response = {
+            "type": "hello_ack",
+            "session_id": session_id,
+            "capabilities": {
+                "binary_audio": bool(capabilities.get("binary_audio")),
+                "stream_text": bool(capabilities.get("stream_text")),
+                "deadline_ms": round(start_deadline(websocket).budget * 1000),
+                "audio_format": capabilities["audio_format"]
+            }
+        }
+        await manager.send_personal_message(json.dumps(hello_response), websocket)
+        if capabilities.get("greeting"):
+            await send_ai_audio(websocket, session_id, prompts.audio("greeting", capabilities["audio_format"]))
+    
+    elif message_type == "cancel":
+        # Barge-in or stop: abort the given turn, or everything in flight when no turn_id is sent
+        cancelled = manager.cancel_turns(websocket, turn_id)
+        cancel_response = {
+            "type": "cancelled",
+            "turn_ids": cancelled,
+            "session_id": session_id
+        }
+        if turn_id is not None:
+            cancel_response["turn_id"] = turn_id
+        await manager.send_personal_message(json.dumps(cancel_response), websocket)
+    
+    elif message_type == "ping":
+        # Respond to ping with pong
+        pong_response = {
+            "type": "pong", 
+            "session_id": session_id,
+            "timestamp": asyncio.get_event_loop().time()
+        }
+        await manager.send_personal_message(json.dumps(pong_response), websocket)
+
+async def handle_binary_frame(websocket: WebSocket, session_id: str, data: bytes):
+    """Dispatch a binary frame carrying raw audio"""
+    try:
+        frame = unpack_frame(data)
+    except FrameError as e:
+        await send_error(websocket, session_id, str(e))
+        return
+    
+    logger.debug(f"Received binary frame kind={frame.kind} turn={frame.turn_id} ({len(frame.payload)} bytes)")
+    
+    if frame.kind == FRAME_AUDIO_CLIP:
+        if len(frame.payload) > MAX_AUDIO_BYTES:
+            await send_error(websocket, session_id, "Audio clip is too large", frame.turn_id)
+            return
+        if len(frame.payload):
+            if not await validate_audio(websocket, session_id, frame.payload, frame.turn_id):
+                return
+            turn = process_audio_turn(websocket, session_id, bytes(frame.payload), frame.turn_id, start_deadline(websocket))
+            await enqueue_turn(websocket, session_id, turn, frame.turn_id)
+    elif frame.kind == FRAME_AUDIO_CHUNK:
+        await buffer_audio_chunk(websocket, session_id, frame.turn_id, frame.payload)
+        if frame.flags & FLAG_TURN_END:
+            await finish_audio_upload(websocket, session_id, frame.turn_id)
+    else:
+        await send_error(websocket, session_id, f"Unsupported binary frame kind: {frame.kind}", frame.turn_id)
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     session_id = await manager.connect(websocket)
+    # The reader below only dispatches frames; turns run on this worker so pings and
+    # control messages are answered immediately, even while a turn is in progress
+    turn_queue = manager.turn_queues[websocket]
+    worker = asyncio.create_task(turn_worker(websocket, turn_queue))
     try:
         while True:
-            # Receive message from client
-            data = await websocket.receive_text()
-            logger.info(f"Received message type: {data[:100]}...")
+            # Receive message from client - text frames carry JSON, binary frames carry audio
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
             
-            try:
-                message_data = json.loads(data)
-                message_type = message_data.get("type")
-                
-                if message_type == "audio_data":
-                    # Handle audio data for transcription
-                    audio_base64 = message_data.get("audio", "")
-                    if audio_base64:
-                        try:
-                            # Decode base64 audio data
-                            audio_data = base64.b64decode(audio_base64)
-                            
-                            # Transcribe audio using Whisper
-                            transcribed_text = transcribe_audio(audio_data)
-                            
-                            if transcribed_text and not transcribed_text.startswith("I'm sorry"):
-                                # Get AI response with conversation context
-                                ai_response = await get_ai_response_async(transcribed_text, session_id)
-                                
-                                # Save conversation to database
-                                try:
-                                    await db.add_message(session_id, transcribed_text, ai_response, transcribed_text)
-                                except Exception as e:
-                                    logger.error(f"Error saving conversation to database: {e}")
-                                
-                                # Generate speech for the response
-                                speech_data = generate_speech(ai_response)
-                                speech_base64 = base64.b64encode(speech_data).decode('utf-8') if speech_data else ""
-                                
-                                # Send response back to client
-                                response = {
-                                    "type": "ai_response",
-                                    "transcription": transcribed_text,
-                                    "message": ai_response,
-                                    "audio": speech_base64,
-                                    "session_id": session_id,
-                                    "timestamp": asyncio.get_event_loop().time()
-                                }
-                            else:
-                                # Error in transcription
-                                response = {
-                                    "type": "error",
-                                    "message": transcribed_text,
-                                    "session_id": session_id,
-                                    "timestamp": asyncio.get_event_loop().time()
-                                }
-                                
-                            await manager.send_personal_message(json.dumps(response), websocket)
-                            
-                        except Exception as e:
-                            logger.error(f"Error processing audio: {str(e)}")
-                            error_response = {
-                                "type": "error",
-                                "message": f"Error processing audio: {str(e)}",
-                                "session_id": session_id
-                            }
-                            await manager.send_personal_message(json.dumps(error_response), websocket)
-                
-                elif message_type == "voice_message":
-                    # Handle text message (for backward compatibility)
-                    user_message = message_data.get("message", "")
-                    if user_message:
-                        # Get AI response with conversation context
-                        ai_response = await get_ai_response_async(user_message, session_id)
-                        
-                        # Save conversation to database
-                        try:
-                            await db.add_message(session_id, user_message, ai_response)
-                        except Exception as e:
-                            logger.error(f"Error saving conversation to database: {e}")
-                        
-                        # Generate speech for the response
-                        speech_data = generate_speech(ai_response)
-                        speech_base64 = base64.b64encode(speech_data).decode('utf-8') if speech_data else ""
-                        
-                        # Send response back to client
-                        response = {
-                            "type": "ai_response",
-                            "message": ai_response,
-                            "audio": speech_base64,
-                            "session_id": session_id,
-                            "timestamp": asyncio.get_event_loop().time()
-                        }
-                        await manager.send_personal_message(json.dumps(response), websocket)
-                
-                elif message_type == "ping":
-                    # Respond to ping with pong
-                    pong_response = {
-                        "type": "pong", 
-                        "session_id": session_id,
-                        "timestamp": asyncio.get_event_loop().time()
-                    }
-                    await manager.send_personal_message(json.dumps(pong_response), websocket)
-                    
-            except json.JSONDecodeError:
-                error_response = {
-                    "type": "error",
-                    "message": "Invalid JSON format",
-                    "session_id": session_id
-                }
-                await manager.send_personal_message(json.dumps(error_response), websocket)
+            if message.get("bytes") is not None:
+                await handle_binary_frame(websocket, session_id, message["bytes"])
+            elif message.get("text") is not None:
+                await handle_text_frame(websocket, session_id, message["text"])
                 
     except WebSocketDisconnect:
+        pass
+    finally:
+        # Nobody will hear the answer - abort the in-flight turn and anything queued behind it,
+        # before disconnect() drops the session's queue, whichever way the socket ended
+        manager.cancel_turns(websocket)
         manager.disconnect(websocket)
+        await turn_queue.put(None)
+        await worker
 
 @app.get("/")
 async def get():
@@ -303,6 +1073,17 @@ async def get():
 async def health_check():
     return {"status": "healthy", "message": "Voice assistant server is running"}
 
+@app.get("/api/stats")
+async def get_stats():
+    """Upstream scheduler queue depths, wait times, per-stage latency percentiles, cache hit rates and database write queue"""
+    return {
+        "scheduler": scheduler.stats(),
+        "hedging": hedger.stats(),
+        "caches": {"transcription": transcription_cache.stats(), "tts": speech_cache.stats()},
+        "prompts": prompts.stats(),
+        "database": db.stats()
+    }
+
 @app.get("/api/conversations/{session_id}")
 async def get_conversation(session_id: str, limit: int = 50):
     """Get conversation history for a session"""
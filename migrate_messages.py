@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Online migration of conversations to bucketed message storage
+
+Conversations written before message buckets keep every message in an
+embedded `messages` array. This moves them into the message_buckets
+collection one session at a time, while the server keeps serving: reads
+use the embedded array until the moment it is removed, and sessions that
+receive new messages during the migration are retried. Reruns are safe.
+"""
+import argparse
+import asyncio
+import logging
+
+from database import db
+
+async def migrate(dry_run: bool, limit: int):
+    await db.connect()
+    try:
+        legacy = db.conversations.find({"messages": {"$exists": True}}, {"session_id": 1})
+        if limit:
+            legacy = legacy.limit(limit)
+        session_ids = [conversation["session_id"] async for conversation in legacy]
+        print(f"{len(session_ids)} conversations to migrate")
+        if dry_run:
+            return
+
+        migrated = messages = failed = 0
+        for session_id in session_ids:
+            try:
+                messages += await db.migrate_conversation(session_id)
+                migrated += 1
+            except Exception as e:
+                failed += 1
+                logging.error(f"Could not migrate conversation {session_id}: {e}")
+        print(f"Migrated {messages} messages in {migrated} conversations, {failed} failed")
+    finally:
+        await db.disconnect()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="only count the conversations left to migrate")
+    parser.add_argument("--limit", type=int, default=0, help="migrate at most this many conversations")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(migrate(args.dry_run, args.limit))
@@ -0,0 +1,91 @@
+"""
+Canned prompts with pre-rendered audio
+
+Greetings, "still thinking" fillers and error replies are synthesized (or
+loaded from PROMPTS_DIR) once at startup, in every audio format clients can
+negotiate, so they can be played instantly and without any upstream call -
+including while OpenAI is the reason for the error. When PROMPTS_DIR is set,
+freshly synthesized prompts are written there and later starts load them from
+disk.
+"""
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Directory holding pre-rendered prompt audio, one <name>.<format> file per prompt and format
+PROMPTS_DIR = os.getenv("PROMPTS_DIR")
+
+CANNED_PROMPTS = {
+    "greeting": "Hi! I'm listening. What can I do for you?",
+    "thinking": "Let me think about that for a moment.",
+    "no_speech": "I didn't catch anything. Could you say that again?",
+    "transcription_failed": "I'm sorry, I couldn't understand the audio. Could you try again?",
+    "stt_unavailable": "I'm sorry, the speech recognition service is temporarily unavailable. Please try again in a moment.",
+    "chat_unavailable": "I'm sorry, the AI service is temporarily unavailable. Please try again in a moment.",
+    "deadline": "I'm sorry, that took too long. Please try again.",
+    "busy": "I'm still working on your earlier requests. Please wait a moment.",
+}
+
+class CannedPrompts:
+    def __init__(self, texts: Dict[str, str] = None, directory: Optional[str] = PROMPTS_DIR):
+        self.texts = dict(texts or CANNED_PROMPTS)
+        self.directory = directory or None
+        self.rendered: Dict[Tuple[str, str], bytes] = {}  # (name, format) -> audio
+
+    def text(self, name: str) -> str:
+        return self.texts[name]
+
+    def audio(self, name: str, audio_format: str = "mp3") -> bytes:
+        """Pre-rendered audio for a prompt, or b"" if it could not be rendered"""
+        return self.rendered.get((name, audio_format), b"")
+
+    def audio_for_text(self, text: str, audio_format: str = "mp3") -> Optional[bytes]:
+        """Pre-rendered audio when `text` is one of the canned prompts"""
+        for name, prompt in self.texts.items():
+            if prompt == text and (name, audio_format) in self.rendered:
+                return self.rendered[(name, audio_format)]
+        return None
+
+    async def load(self, synthesize: Callable[[str, str], Awaitable[bytes]], formats: Iterable[str]):
+        """Load every prompt in every format from PROMPTS_DIR, synthesizing (and saving) the ones that are missing"""
+        async def render(name: str, text: str, audio_format: str):
+            audio = await asyncio.to_thread(self._read, name, audio_format) if self.directory else None
+            if not audio:
+                audio = await synthesize(text, audio_format)
+                if audio and self.directory:
+                    await asyncio.to_thread(self._write, name, audio_format, audio)
+            if audio:
+                self.rendered[(name, audio_format)] = audio
+
+        formats = list(dict.fromkeys(formats))
+        await asyncio.gather(*(
+            render(name, text, audio_format) for name, text in self.texts.items() for audio_format in formats
+        ))
+        logger.info(f"Loaded audio for {len(self.rendered)} of {len(self.texts) * len(formats)} canned prompts")
+
+    def stats(self) -> Dict:
+        return {"prompts": len(self.texts), "rendered": sorted(f"{name}.{audio_format}" for name, audio_format in self.rendered)}
+
+    def _path(self, name: str, audio_format: str) -> str:
+        return os.path.join(self.directory, f"{name}.{audio_format}")
+
+    def _read(self, name: str, audio_format: str) -> Optional[bytes]:
+        try:
+            with open(self._path(name, audio_format), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write(self, name: str, audio_format: str, audio: bytes):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self._path(name, audio_format), "wb") as f:
+                f.write(audio)
+        except OSError as e:
+            logger.warning(f"Could not save canned prompt {name}.{audio_format}: {e}")
+
+# Global canned prompts instance
+prompts = CannedPrompts()
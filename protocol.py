@@ -0,0 +1,72 @@
+"""
+Binary WebSocket frame format shared with static/script.js
+
+Every binary frame starts with a fixed 8-byte header followed by the raw
+payload:
+
+    kind     uint8   what the payload is (FRAME_* constants)
+    flags    uint8   bit flags (FLAG_* constants)
+    seq      uint16  sequence number within the turn
+    turn_id  uint32  client-assigned turn identifier
+
+All fields are big-endian. JSON text frames keep working alongside binary
+frames for older clients.
+"""
+import struct
+from typing import NamedTuple
+
+FRAME_HEADER = struct.Struct("!BBHI")
+
+# Frame kinds
+FRAME_AUDIO_CLIP = 0x01  # client -> server: a complete recorded clip
+FRAME_AUDIO_CHUNK = 0x02 # client -> server: one slice of a clip still being recorded
+FRAME_TTS_AUDIO = 0x81   # server -> client: synthesized speech for a turn
+
+# Frame flags
+FLAG_SEGMENT_END = 0x01  # last frame of an audio segment
+FLAG_TURN_END = 0x02     # last frame of the turn
+
+# Largest turn ID the frame header can carry; JSON messages are held to the same range
+MAX_TURN_ID = 0xFFFFFFFF
+
+# Payload size of each outgoing audio frame
+MAX_FRAME_PAYLOAD = 64 * 1024
+
+class FrameError(ValueError):
+    """Raised when a binary frame cannot be decoded"""
+
+class Frame(NamedTuple):
+    kind: int
+    flags: int
+    seq: int
+    turn_id: int
+    payload: memoryview
+
+def pack_frame_header(kind: int, turn_id: int, seq: int = 0, flags: int = 0) -> bytes:
+    """Build the header for a binary frame"""
+    return FRAME_HEADER.pack(kind, flags, seq & 0xFFFF, turn_id & 0xFFFFFFFF)
+
+def iter_frames(kind: int, turn_id: int, payload: bytes, seq: int = 0, final: bool = True):
+    """Split a payload into binary frames of at most MAX_FRAME_PAYLOAD bytes
+
+    The last frame carries FLAG_SEGMENT_END, plus FLAG_TURN_END when `final`.
+    """
+    view = memoryview(payload)
+    offsets = range(0, len(view), MAX_FRAME_PAYLOAD) if len(view) else [0]
+    last = offsets[-1]
+    for offset in offsets:
+        flags = 0
+        if offset == last:
+            flags = FLAG_SEGMENT_END | (FLAG_TURN_END if final else 0)
+        yield pack_frame_header(kind, turn_id, seq, flags) + view[offset:offset + MAX_FRAME_PAYLOAD]
+
+def is_turn_id(value) -> bool:
+    """Whether a turn ID taken from a JSON message fits the binary frame header"""
+    return isinstance(value, int) and not isinstance(value, bool) and 0 <= value <= MAX_TURN_ID
+
+def unpack_frame(data: bytes) -> Frame:
+    """Split a binary frame into its header fields and a zero-copy payload view"""
+    if len(data) < FRAME_HEADER.size:
+        raise FrameError(f"Binary frame too short: {len(data)} bytes")
+    kind, flags, seq, turn_id = FRAME_HEADER.unpack_from(data)
+    return Frame(kind, flags, seq, turn_id, memoryview(data)[FRAME_HEADER.size:])
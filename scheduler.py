@@ -0,0 +1,309 @@
+"""
+Admission control for upstream OpenAI calls
+
+Each pipeline stage (speech-to-text, chat, text-to-speech) has its own
+concurrency limit. When a stage is saturated, callers wait in per-session
+queues that are served round-robin, so one chatty session cannot starve the
+others.
+
+The limit adapts to the provider (AIMD): every success raises it additively
+up to the configured maximum, and a 429 or 5xx halves it. A Retry-After
+header pauses the whole stage for the requested time, and overloaded requests
+are retried once the stage admits them again. Each stage also has a circuit
+breaker (see circuit.py) so requests fail fast while the provider is down.
+"""
+import asyncio
+import os
+import random
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+import openai
+
+from circuit import CircuitBreaker
+from deadline import DeadlineExceeded, within
+from hedging import hedger
+
+STAGE_LIMITS = {
+    "stt": int(os.getenv("STT_CONCURRENCY", "8")),
+    "chat": int(os.getenv("CHAT_CONCURRENCY", "16")),
+    "tts": int(os.getenv("TTS_CONCURRENCY", "8")),
+}
+
+# Lowest concurrency a stage backs off to
+MIN_CONCURRENCY = int(os.getenv("UPSTREAM_MIN_CONCURRENCY", "1"))
+
+# Multiplicative decrease applied on overload
+BACKOFF_FACTOR = 0.5
+
+# Attempts after the first for overloaded or unreachable upstream requests
+MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "3"))
+
+# Base delay for exponential backoff when no Retry-After header is given
+RETRY_BASE_DELAY = 0.5
+
+ANONYMOUS_SESSION = "anonymous"
+
+def is_overload(error: BaseException) -> bool:
+    """Whether an error means the provider is rate limiting or overloaded"""
+    if isinstance(error, openai.RateLimitError):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+def is_retryable(error: BaseException) -> bool:
+    return is_overload(error) or isinstance(error, openai.APIConnectionError)
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """Read the Retry-After delay from an API error response, if any"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class StageScheduler:
+    def __init__(self, name: str, limit: int, min_limit: int = MIN_CONCURRENCY):
+        self.name = name
+        self.max_limit = max(1, limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.current_limit = float(self.max_limit)
+        self.active = 0
+        # session_id -> waiting futures; dict order is the round-robin order
+        self.waiters: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.admitted = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.successes = 0
+        self.overloads = 0
+        self.retries = 0
+
+    @property
+    def limit(self) -> int:
+        return int(self.current_limit)
+
+    @property
+    def queued(self) -> int:
+        return sum(len(waiting) for waiting in self.waiters.values())
+
+    def _has_capacity(self) -> bool:
+        return self.active < self.limit and time.monotonic() >= self.paused_until
+
+    async def acquire(self, session_id: str):
+        """Wait for a free slot, taking turns with the other sessions that are waiting"""
+        started = time.monotonic()
+        if self._has_capacity() and not self.waiters:
+            self.active += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self.waiters.setdefault(session_id, deque()).append(future)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # The slot was handed over just as we were cancelled - pass it on
+                    self.release()
+                else:
+                    self._discard(session_id, future)
+                raise
+        self._record_wait(time.monotonic() - started)
+
+    def try_acquire(self) -> bool:
+        """Take a slot only if one is free right now and nobody is waiting for it"""
+        if self._has_capacity() and not self.waiters:
+            self.active += 1
+            return True
+        return False
+
+    def release(self):
+        self.active -= 1
+        self._admit_next()
+
+    @asynccontextmanager
+    async def slot(self, session_id: str = None):
+        await self.acquire(session_id or ANONYMOUS_SESSION)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def record_success(self):
+        """Additive increase: roughly one more slot per window of successful requests"""
+        self.successes += 1
+        self.current_limit = min(self.max_limit, self.current_limit + 1 / self.current_limit)
+        self._admit_next()
+
+    def record_overload(self, started: float, retry_after: Optional[float] = None):
+        """Multiplicative decrease, at most once per window of requests that were already in flight"""
+        self.overloads += 1
+        now = time.monotonic()
+        if started >= self.last_decrease:
+            self.current_limit = max(self.min_limit, self.current_limit * BACKOFF_FACTOR)
+            self.last_decrease = now
+        if retry_after:
+            self.pause(retry_after)
+
+    def pause(self, delay: float):
+        """Stop admitting requests for `delay` seconds"""
+        resume_at = time.monotonic() + delay
+        if resume_at > self.paused_until:
+            self.paused_until = resume_at
+            asyncio.get_running_loop().call_later(delay, self._admit_next)
+
+    def stats(self) -> Dict:
+        return {
+            "limit": self.limit,
+            "max_limit": self.max_limit,
+            "active": self.active,
+            "queued": self.queued,
+            "queued_sessions": len(self.waiters),
+            "admitted": self.admitted,
+            "avg_wait_ms": round(self.total_wait / self.admitted * 1000, 1) if self.admitted else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 1),
+            "successes": self.successes,
+            "overloads": self.overloads,
+            "retries": self.retries,
+            "paused_ms": round(max(0.0, self.paused_until - time.monotonic()) * 1000, 1),
+        }
+
+    def _admit_next(self):
+        while self._has_capacity() and self.waiters:
+            session_id, waiting = next(iter(self.waiters.items()))
+            future = waiting.popleft()
+            if waiting:
+                # Serve this session's next request only after every other session had a go
+                self.waiters.move_to_end(session_id)
+            else:
+                del self.waiters[session_id]
+            if future.done():
+                continue
+            self.active += 1
+            future.set_result(None)
+
+    def _discard(self, session_id: str, future: asyncio.Future):
+        waiting = self.waiters.get(session_id)
+        if waiting is None:
+            return
+        try:
+            waiting.remove(future)
+        except ValueError:
+            pass
+        if not waiting:
+            del self.waiters[session_id]
+
+    def _record_wait(self, waited: float):
+        self.admitted += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+class UpstreamScheduler:
+    def __init__(self, limits: Dict[str, int] = None):
+        self.stages = {name: StageScheduler(name, limit) for name, limit in (limits or STAGE_LIMITS).items()}
+        self.breakers = {name: CircuitBreaker(name) for name in self.stages}
+
+    def slot(self, stage: str, session_id: str = None):
+        """Async context manager holding one of the stage's concurrency slots"""
+        return self.stages[stage].slot(session_id)
+
+    def is_open(self, stage: str) -> bool:
+        """Whether the stage's circuit breaker is rejecting requests"""
+        return self.breakers[stage].is_open
+
+    @asynccontextmanager
+    async def hold(self, stage: str, session_id: str, request: Callable[[], Awaitable[Any]], hedge: bool = False):
+        """Send `request` through the stage, retrying on overload, and keep the slot while the block runs
+
+        Used for streamed responses, where the slot must stay taken until the stream is consumed.
+        With `hedge`, a slow request is duplicated (see hedging.py) if the stage has a spare slot.
+        Raises CircuitOpenError without calling the provider while the stage's breaker is open, and
+        DeadlineExceeded when the current turn's budget runs out while queued or waiting for the provider;
+        only the latter counts as a provider failure.
+        """
+        scheduler = self.stages[stage]
+        breaker = self.breakers[stage]
+        session_id = session_id or ANONYMOUS_SESSION
+        attempt = 0
+        while True:
+            breaker.check()
+            try:
+                await within(scheduler.acquire(session_id))
+            except BaseException:
+                breaker.abandon()
+                raise
+            started = time.monotonic()
+            try:
+                if hedge:
+                    result = await within(hedger.run(stage, request, (scheduler.try_acquire, scheduler.release)))
+                else:
+                    result = await within(request())
+            except DeadlineExceeded:
+                # The provider had the request for the rest of the turn's budget without answering.
+                # Counted like a timeout, since a hung provider never reaches the (longer) HTTP timeout.
+                scheduler.release()
+                scheduler.record_overload(started)
+                breaker.record_failure()
+                raise
+            except Exception as e:
+                scheduler.release()
+                retry_after = None
+                if is_overload(e):
+                    retry_after = retry_after_seconds(e)
+                    scheduler.record_overload(started, retry_after)
+                if is_retryable(e):
+                    breaker.record_failure()
+                else:
+                    # The provider answered, so it is up - this request was simply rejected
+                    breaker.record_success()
+                if not is_retryable(e) or attempt >= MAX_RETRIES or breaker.is_open:
+                    raise
+                attempt += 1
+                scheduler.retries += 1
+                if retry_after is None:
+                    # No pacing hint from the provider - back off exponentially with jitter
+                    await within(asyncio.sleep(RETRY_BASE_DELAY * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)))
+                continue
+            except BaseException:
+                scheduler.release()
+                breaker.abandon()
+                raise
+            break
+
+        scheduler.record_success()
+        breaker.record_success()
+        try:
+            yield result
+        finally:
+            scheduler.release()
+
+    async def call(self, stage: str, session_id: str, request: Callable[[], Awaitable[Any]], hedge: bool = False) -> Any:
+        """Send `request` through the stage's admission control, retrying on overload"""
+        async with self.hold(stage, session_id, request, hedge) as result:
+            return result
+
+    def stats(self) -> Dict[str, Dict]:
+        return {name: {**stage.stats(), "circuit": self.breakers[name].stats()} for name, stage in self.stages.items()}
+
+# Global scheduler instance
+scheduler = UpstreamScheduler()
@@ -0,0 +1,48 @@
+"""
+Incremental sentence segmentation for streamed LLM output
+
+Text deltas are fed in as they arrive and complete sentences come out as
+soon as their boundary is seen, so each one can be sent to TTS while the
+rest of the reply is still being generated.
+"""
+import re
+from typing import List
+
+# Shorter sentences are merged with the next one to avoid tiny TTS requests
+MIN_SENTENCE_CHARS = 12
+
+# Sentence-ending punctuation (optionally closed by quotes/brackets) followed by
+# whitespace, or a line break. Requiring the whitespace keeps "3.5" together.
+_BOUNDARY = re.compile(r"[.!?]+[\"')\]]*\s+|\n+")
+
+_ABBREVIATIONS = {"mr.", "mrs.", "ms.", "dr.", "st.", "vs.", "e.g.", "i.e.", "etc.", "approx."}
+
+class SentenceSplitter:
+    def __init__(self, min_chars: int = MIN_SENTENCE_CHARS):
+        self.min_chars = min_chars
+        self.buffer = ""
+
+    def feed(self, text: str) -> List[str]:
+        """Add a text delta and return any sentences it completed"""
+        self.buffer += text
+        sentences = []
+        start = 0
+        for match in _BOUNDARY.finditer(self.buffer):
+            candidate = self.buffer[start:match.end()].strip()
+            if len(candidate) < self.min_chars or self._ends_with_abbreviation(candidate):
+                continue
+            sentences.append(candidate)
+            start = match.end()
+        self.buffer = self.buffer[start:]
+        return sentences
+
+    def flush(self) -> str:
+        """Return whatever text is left once the stream has ended"""
+        remainder = self.buffer.strip()
+        self.buffer = ""
+        return remainder
+
+    @staticmethod
+    def _ends_with_abbreviation(text: str) -> bool:
+        last_word = text.rsplit(None, 1)[-1].lower()
+        return last_word in _ABBREVIATIONS
@@ -0,0 +1,141 @@
+"""
+In-process cache of each session's most recent messages
+
+Every turn reads the session's last few exchanges for context, and almost
+always this process wrote them moments earlier. Each session gets a ring
+buffer of its newest messages, written through when a message is added and
+filled from the database only on a cold miss. Sessions idle for longer than
+the TTL are dropped, and the least recently used ones are evicted whenever
+the cache's estimated size exceeds its ceiling.
+"""
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+# Rough per-message bookkeeping on top of its text (dict, timestamps, seq)
+MESSAGE_OVERHEAD_BYTES = 400
+
+def message_size(message: Dict) -> int:
+    text = sum(len(message.get(field) or "") for field in ("user_message", "ai_response", "transcription"))
+    return text + MESSAGE_OVERHEAD_BYTES
+
+class SessionEntry:
+    def __init__(self, turns: int):
+        self.messages: Deque[Dict] = deque(maxlen=turns)
+        self.complete = False  # holds the session's entire history
+        self.writes = 0  # messages appended since the entry was created
+        self.size = 0
+        self.last_used = time.monotonic()
+
+class SessionContextCache:
+    def __init__(self, turns: int, ttl: float, max_bytes: int):
+        self.turns = turns
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sessions: "OrderedDict[str, SessionEntry]" = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, session_id: str, limit: int) -> Optional[List[Dict]]:
+        """The session's last `limit` messages, or None when they have to be read from the database"""
+        entry = self._entry(session_id)
+        if entry is None or (len(entry.messages) < limit and not entry.complete):
+            self.misses += 1
+            return None
+        self.hits += 1
+        messages = list(entry.messages)
+        return messages[-limit:] if limit > 0 else []
+
+    def read_token(self, session_id: str) -> Tuple[int, int]:
+        """Token to pass to fill() for a database read started now"""
+        entry = self.sessions.get(session_id)
+        return self.invalidations, entry.writes if entry else 0
+
+    def fill(self, session_id: str, messages: List[Dict], complete: bool, token: Tuple[int, int]):
+        """Store messages read from the database; `token` is what read_token() returned before the read"""
+        invalidations, writes = token
+        if invalidations != self.invalidations:
+            return  # a session was deleted meanwhile; the read may be stale
+        entry = self.sessions.get(session_id)
+        newer = []
+        if entry is not None:
+            # Messages appended while the read was in flight are newer than everything it returned
+            appended = entry.writes - writes
+            newer = list(entry.messages)[-appended:] if appended > 0 else []
+            self._drop(session_id)
+        entry = self._create(session_id)
+        entry.complete = complete
+        for message in messages + newer:
+            self._append(entry, message)
+        self._enforce_limits()
+
+    def append(self, session_id: str, message: Dict):
+        """Write-through of a newly added message"""
+        entry = self._entry(session_id) or self._create(session_id)
+        entry.writes += 1
+        self._append(entry, message)
+        self._enforce_limits()
+
+    def invalidate(self, session_id: str):
+        self.invalidations += 1
+        if session_id in self.sessions:
+            self._drop(session_id)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "sessions": len(self.sessions),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+    def _entry(self, session_id: str) -> Optional[SessionEntry]:
+        entry = self.sessions.get(session_id)
+        if entry is None:
+            return None
+        now = time.monotonic()
+        if now - entry.last_used > self.ttl:
+            self._drop(session_id)
+            self.evictions += 1
+            return None
+        entry.last_used = now
+        self.sessions.move_to_end(session_id)
+        return entry
+
+    def _create(self, session_id: str) -> SessionEntry:
+        entry = SessionEntry(self.turns)
+        self.sessions[session_id] = entry
+        return entry
+
+    def _append(self, entry: SessionEntry, message: Dict):
+        if len(entry.messages) == entry.messages.maxlen:
+            # The ring is full: the oldest message falls out
+            dropped = message_size(entry.messages[0])
+            entry.size -= dropped
+            self.size -= dropped
+            entry.complete = False
+        entry.messages.append(message)
+        size = message_size(message)
+        entry.size += size
+        self.size += size
+
+    def _drop(self, session_id: str):
+        entry = self.sessions.pop(session_id)
+        self.size -= entry.size
+
+    def _enforce_limits(self):
+        now = time.monotonic()
+        # Idle sessions first, then the least recently used ones until the cache fits
+        while self.sessions:
+            session_id, entry = next(iter(self.sessions.items()))
+            if now - entry.last_used <= self.ttl and self.size <= self.max_bytes:
+                break
+            self._drop(session_id)
+            self.evictions += 1
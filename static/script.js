@@ -1,12 +1,61 @@
+// Binary frame format shared with protocol.py: kind, flags, seq, turn_id (big-endian)
+const FRAME_HEADER_SIZE = 8;
+const FRAME_AUDIO_CHUNK = 0x02;
+const FRAME_TTS_AUDIO = 0x81;
+const FLAG_SEGMENT_END = 0x01;
+const FLAG_TURN_END = 0x02;
+
+// Upload recorded audio in slices of this many milliseconds while the user is speaking
+const RECORDER_TIMESLICE_MS = 250;
+
+// Speech formats the server can send, with the MIME types used to play them; pcm is raw
+// 16-bit little-endian mono at PCM_SAMPLE_RATE and is played through Web Audio instead
+const AUDIO_MIME_TYPES = {
+    opus: 'audio/ogg; codecs=opus',
+    aac: 'audio/aac',
+    mp3: 'audio/mpeg'
+};
+const PCM_SAMPLE_RATE = 24000;
+
+function supportedAudioFormats() {
+    // Add ?audio=pcm (or another format) to the page URL to request that format only
+    const forced = new URLSearchParams(window.location.search).get('audio');
+    if (forced) return [forced];
+    
+    const probe = document.createElement('audio');
+    const formats = Object.keys(AUDIO_MIME_TYPES).filter(format => probe.canPlayType(AUDIO_MIME_TYPES[format]) !== '');
+    if (window.AudioContext || window.webkitAudioContext) {
+        formats.push('pcm');
+    }
+    return formats;
+}
+
+function encodeFrameHeader(kind, turnId, seq = 0, flags = 0) {
+    const header = new ArrayBuffer(FRAME_HEADER_SIZE);
+    const view = new DataView(header);
+    view.setUint8(0, kind);
+    view.setUint8(1, flags);
+    view.setUint16(2, seq & 0xffff);
+    view.setUint32(4, turnId >>> 0);
+    return header;
+}
+
 class VoiceAssistant {
     constructor() {
         this.ws = null;
         this.mediaRecorder = null;
-        this.audioChunks = [];
+        this.chunkSeq = 0;
         this.isRecording = false;
         this.isProcessing = false;
         this.stream = null;
         this.sessionId = null;
+        this.turnId = 0;
+        this.pendingAudio = new Map(); // turn ID -> received audio frame payloads
+        this.streamingMessage = null; // text element of the response being streamed
+        this.playbackQueue = []; // audio segments waiting to be played in order
+        this.currentAudio = null;
+        this.audioFormat = 'mp3'; // negotiated in hello
+        this.audioContext = null; // plays pcm segments
         
         this.micButton = document.getElementById('micButton');
         this.status = document.getElementById('status');
@@ -45,14 +94,23 @@ class VoiceAssistant {
         this.updateConnectionStatus('connecting', 'Connecting...');
         
         this.ws = new WebSocket(wsUrl);
+        this.ws.binaryType = 'arraybuffer';
         
         this.ws.onopen = () => {
             console.log('WebSocket connected');
+            this.ws.send(JSON.stringify({
+                type: 'hello',
+                capabilities: { binary_audio: true, stream_text: true, audio_formats: supportedAudioFormats() }
+            }));
             this.updateConnectionStatus('connected', 'Connected');
             this.updateStatus('Ready to listen');
         };
         
         this.ws.onmessage = (event) => {
+            if (event.data instanceof ArrayBuffer) {
+                this.handleBinaryFrame(event.data);
+                return;
+            }
             try {
                 const data = JSON.parse(event.data);
                 this.handleWebSocketMessage(data);
@@ -105,22 +163,63 @@ class VoiceAssistant {
                 } else {
                     this.startRecording();
                 }
+            } else if (event.code === 'Escape') {
+                this.cancelResponse();
             }
         });
     }
     
+    cancelResponse() {
+        // Abort the in-flight turn on the server and silence anything already playing
+        if (!this.isProcessing && !this.currentAudio) return;
+        
+        if (this.ws && this.ws.readyState === WebSocket.OPEN) {
+            this.ws.send(JSON.stringify({ type: 'cancel' }));
+        }
+        this.stopPlayback();
+        this.pendingAudio.clear();
+        this.streamingMessage = null;
+        this.isProcessing = false;
+        this.micButton.classList.remove('processing');
+        this.updateStatus('Ready to listen');
+    }
+    
+    stopPlayback() {
+        this.playbackQueue = [];
+        if (this.currentAudio) {
+            const audio = this.currentAudio;
+            this.currentAudio = null;
+            if (audio instanceof HTMLMediaElement) {
+                audio.pause();
+                URL.revokeObjectURL(audio.src);
+            } else if (audio instanceof AudioBufferSourceNode) {
+                audio.stop(); // Web Audio source playing a pcm segment
+            }
+        }
+    }
+    
     startRecording() {
-        if (!this.stream || this.isRecording || this.isProcessing) return;
+        if (!this.stream || this.isRecording) return;
+        
+        // Barge-in: speaking again interrupts the current response
+        this.cancelResponse();
+        
+        // Web Audio may only start after a user gesture, so unlock it here for pcm replies
+        if (this.audioFormat === 'pcm') {
+            this.getAudioContext().resume();
+        }
         
         try {
-            this.audioChunks = [];
+            this.turnId += 1;
+            this.chunkSeq = 0;
             this.mediaRecorder = new MediaRecorder(this.stream, {
                 mimeType: 'audio/webm;codecs=opus'
             });
             
+            // Stream each slice to the server as soon as it is recorded
             this.mediaRecorder.ondataavailable = (event) => {
                 if (event.data.size > 0) {
-                    this.audioChunks.push(event.data);
+                    this.sendAudioChunk(event.data);
                 }
             };
             
@@ -128,7 +227,7 @@ class VoiceAssistant {
                 this.processRecording();
             };
             
-            this.mediaRecorder.start();
+            this.mediaRecorder.start(RECORDER_TIMESLICE_MS);
             this.isRecording = true;
             this.micButton.classList.add('listening');
             this.updateStatus('Listening... Click to stop');
@@ -149,40 +248,23 @@ class VoiceAssistant {
         this.mediaRecorder.stop();
     }
     
-    async processRecording() {
-        if (this.audioChunks.length === 0) return;
-        
-        try {
-            // Create blob from audio chunks
-            const audioBlob = new Blob(this.audioChunks, { type: 'audio/webm;codecs=opus' });
-            
-            // Convert to base64
-            const reader = new FileReader();
-            reader.onload = () => {
-                const base64Audio = reader.result.split(',')[1]; // Remove data:audio/webm;base64, prefix
-                this.sendAudioData(base64Audio);
-            };
-            reader.readAsDataURL(audioBlob);
-            
-        } catch (error) {
-            console.error('Error processing recording:', error);
-            this.updateStatus('Error processing recording.');
-            this.isProcessing = false;
+    sendAudioChunk(chunk) {
+        if (this.ws && this.ws.readyState === WebSocket.OPEN) {
+            // Binary frame: header followed by the raw webm slice
+            const header = encodeFrameHeader(FRAME_AUDIO_CHUNK, this.turnId, this.chunkSeq++);
+            this.ws.send(new Blob([header, chunk]));
         }
     }
     
-    sendAudioData(base64Audio) {
+    processRecording() {
+        if (this.chunkSeq === 0) return;
+        
         if (this.ws && this.ws.readyState === WebSocket.OPEN) {
             this.isProcessing = true;
             this.micButton.classList.add('processing');
             
-            const data = {
-                type: 'audio_data',
-                audio: base64Audio,
-                timestamp: Date.now()
-            };
-            
-            this.ws.send(JSON.stringify(data));
+            // All slices are already uploaded; tell the server to start transcribing
+            this.ws.send(JSON.stringify({ type: 'audio_end', turn_id: this.turnId }));
         } else {
             this.updateStatus('WebSocket not connected. Cannot send audio.');
             this.isProcessing = false;
@@ -197,6 +279,11 @@ class VoiceAssistant {
             this.updateSessionDisplay();
         }
         
+        // Drop late messages from turns that were cancelled or superseded
+        if (data.turn_id !== undefined && data.turn_id !== this.turnId && !['hello_ack', 'pong', 'cancelled'].includes(data.type)) {
+            return;
+        }
+        
         switch (data.type) {
             case 'ai_response':
                 // Add transcription if available
@@ -206,9 +293,9 @@ class VoiceAssistant {
                 
                 this.addMessage(data.message, 'assistant');
                 
-                // Play audio response if available
+                // Play audio response if available; binary audio frames arrive separately
                 if (data.audio) {
-                    this.playAudioResponse(data.audio);
+                    this.playAudioResponse(this.decodeBase64Audio(data.audio));
                 }
                 
                 this.isProcessing = false;
@@ -216,13 +303,53 @@ class VoiceAssistant {
                 this.updateStatus('Ready to listen');
                 break;
                 
+            case 'transcription':
+                this.addMessage(data.transcription, 'user');
+                break;
+                
+            case 'ai_delta':
+                // Render partial text as soon as it arrives
+                if (!this.streamingMessage) {
+                    this.streamingMessage = this.addMessage('', 'assistant');
+                }
+                this.streamingMessage.textContent += data.delta;
+                this.chatMessages.scrollTop = this.chatMessages.scrollHeight;
+                break;
+                
+            case 'ai_done':
+                if (this.streamingMessage) {
+                    this.streamingMessage.textContent = data.message;
+                } else {
+                    this.addMessage(data.message, 'assistant');
+                }
+                this.streamingMessage = null;
+                
+                this.isProcessing = false;
+                this.micButton.classList.remove('processing');
+                this.updateStatus('Ready to listen');
+                break;
+                
+            case 'ai_audio':
+                this.playAudioResponse(this.decodeBase64Audio(data.audio));
+                break;
+                
             case 'error':
                 console.error('Server error:', data.message);
+                this.streamingMessage = null;
                 this.updateStatus(`Error: ${data.message}`);
                 this.isProcessing = false;
                 this.micButton.classList.remove('processing');
                 break;
                 
+            case 'cancelled':
+                console.log('Cancelled turns:', data.turn_ids);
+                break;
+                
+            case 'hello_ack':
+                console.log('Server capabilities:', data.capabilities);
+                this.audioFormat = data.capabilities.audio_format || 'mp3';
+                break;
+                
             case 'pong':
                 console.log('Received pong from server');
                 break;
@@ -232,37 +359,143 @@ class VoiceAssistant {
         }
     }
     
-    playAudioResponse(base64Audio) {
-        try {
-            // Convert base64 to blob
-            const audioData = atob(base64Audio);
-            const arrayBuffer = new ArrayBuffer(audioData.length);
-            const uint8Array = new Uint8Array(arrayBuffer);
-            
-            for (let i = 0; i < audioData.length; i++) {
-                uint8Array[i] = audioData.charCodeAt(i);
+    handleBinaryFrame(buffer) {
+        if (buffer.byteLength < FRAME_HEADER_SIZE) return;
+        
+        const view = new DataView(buffer);
+        const kind = view.getUint8(0);
+        const flags = view.getUint8(1);
+        const turnId = view.getUint32(4);
+        
+        if (kind !== FRAME_TTS_AUDIO) {
+            console.log('Unknown binary frame kind:', kind);
+            return;
+        }
+        if (turnId !== this.turnId) return; // audio for a cancelled turn
+        
+        // Keep a view over the payload instead of copying it out of the frame
+        if (!this.pendingAudio.has(turnId)) {
+            this.pendingAudio.set(turnId, []);
+        }
+        const parts = this.pendingAudio.get(turnId);
+        if (buffer.byteLength > FRAME_HEADER_SIZE) {
+            parts.push(new Uint8Array(buffer, FRAME_HEADER_SIZE));
+        }
+        
+        // Each segment (one sentence when pipelined) plays as soon as it is complete
+        if (flags & FLAG_SEGMENT_END) {
+            if (parts.length > 0) {
+                this.playAudioResponse(new Blob(parts, { type: this.audioMimeType() }));
             }
-            
-            const audioBlob = new Blob([arrayBuffer], { type: 'audio/mpeg' });
+            parts.length = 0;
+        }
+        if (flags & FLAG_TURN_END) {
+            this.pendingAudio.delete(turnId);
+        }
+    }
+    
+    decodeBase64Audio(base64Audio) {
+        // Legacy servers send audio inline as base64
+        const audioData = atob(base64Audio);
+        const uint8Array = new Uint8Array(audioData.length);
+        
+        for (let i = 0; i < audioData.length; i++) {
+            uint8Array[i] = audioData.charCodeAt(i);
+        }
+        
+        return new Blob([uint8Array], { type: this.audioMimeType() });
+    }
+    
+    audioMimeType() {
+        return AUDIO_MIME_TYPES[this.audioFormat] || 'application/octet-stream';
+    }
+    
+    getAudioContext() {
+        if (!this.audioContext) {
+            const AudioContextClass = window.AudioContext || window.webkitAudioContext;
+            this.audioContext = new AudioContextClass({ sampleRate: PCM_SAMPLE_RATE });
+        }
+        return this.audioContext;
+    }
+    
+    async playPcmSegment(audioBlob) {
+        // Raw samples need no decoding: convert them to floats and play them directly
+        const samples = new Int16Array(await audioBlob.arrayBuffer(), 0, Math.floor(audioBlob.size / 2));
+        if (this.currentAudio !== audioBlob) return; // stopped while converting
+        const context = this.getAudioContext();
+        const buffer = context.createBuffer(1, samples.length, PCM_SAMPLE_RATE);
+        const channel = buffer.getChannelData(0);
+        for (let i = 0; i < samples.length; i++) {
+            channel[i] = samples[i] / 32768;
+        }
+        
+        const source = context.createBufferSource();
+        source.buffer = buffer;
+        source.connect(context.destination);
+        source.onended = () => {
+            if (this.currentAudio !== source) return;
+            this.playNextSegment();
+        };
+        this.currentAudio = source;
+        source.start();
+    }
+    
+    playAudioResponse(audioBlob) {
+        // Queue segments so consecutive sentences play back to back
+        this.playbackQueue.push(audioBlob);
+        if (!this.currentAudio) {
+            this.playNextSegment();
+        }
+    }
+    
+    playNextSegment() {
+        const audioBlob = this.playbackQueue.shift();
+        if (!audioBlob) {
+            this.currentAudio = null;
+            return;
+        }
+        
+        if (this.audioFormat === 'pcm') {
+            // Hold the slot while the segment is converted so later segments queue behind it
+            this.currentAudio = audioBlob;
+            this.playPcmSegment(audioBlob).catch(error => {
+                console.error('Error playing audio:', error);
+                if (this.currentAudio === audioBlob) this.playNextSegment();
+            });
+            return;
+        }
+        
+        try {
             const audioUrl = URL.createObjectURL(audioBlob);
             
             const audio = new Audio(audioUrl);
-            audio.onended = () => {
+            this.currentAudio = audio;
+            
+            // Move on to the next segment exactly once, however this one ends
+            const advance = () => {
+                if (this.currentAudio !== audio) return;
                 URL.revokeObjectURL(audioUrl);
+                this.playNextSegment();
+            };
+            
+            audio.onended = () => {
                 console.log('Audio playback completed');
+                advance();
             };
             
             audio.onerror = (error) => {
                 console.error('Error playing audio:', error);
-                URL.revokeObjectURL(audioUrl);
+                advance();
             };
             
             audio.play().catch(error => {
                 console.error('Error starting audio playback:', error);
+                advance();
             });
             
         } catch (error) {
             console.error('Error processing audio response:', error);
+            this.currentAudio = null;
         }
     }
     
@@ -305,6 +538,8 @@ class VoiceAssistant {
         
         // Scroll to bottom
         this.chatMessages.scrollTop = this.chatMessages.scrollHeight;
+        
+        return messageP;
     }
     
     updateStatus(message) {
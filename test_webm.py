@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Test script for the WebM demuxer: corrupted and truncated uploads must only ever raise WebmError
+"""
+import random
+from webm import (CHANNELS, CLUSTER, CODEC_ID, DOC_TYPE, EBML, INFO, SAMPLING_FREQUENCY, SEGMENT,
+                  SIMPLE_BLOCK, TIMECODE, TIMECODE_SCALE, TRACK_ENTRY, TRACK_NUMBER, TRACKS, AUDIO,
+                  WebmError, _element, _encode_id, _uint, parse_webm, slice_webm)
+
+UNKNOWN_SIZE = b"\x01\xff\xff\xff\xff\xff\xff\xff"
+
+def build_clip(clusters: int = 4, info: bytes = None, tracks: bytes = None,
+               sampling_frequency: bytes = b"\x47\x3b\x80\x00") -> bytes:
+    """An Opus clip laid out like MediaRecorder output: 50 blocks of 20 ms per cluster"""
+    header = _element(EBML, _element(DOC_TYPE, b"webm"))
+    if info is None:
+        info = _element(INFO, _element(TIMECODE_SCALE, _uint(1_000_000)))
+    if tracks is None:
+        tracks = _element(TRACKS, _element(
+            TRACK_ENTRY, _element(TRACK_NUMBER, _uint(1)), _element(CODEC_ID, b"A_OPUS"),
+            _element(AUDIO, _element(SAMPLING_FREQUENCY, sampling_frequency), _element(CHANNELS, _uint(1)))
+        ))
+    packet = bytes([0x78]) + bytes(10)  # Opus config 15: one 20 ms frame
+    body = b"".join(
+        _element(CLUSTER, _element(TIMECODE, _uint(cluster * 1000)), *(
+            _element(SIMPLE_BLOCK, b"\x81" + (block * 20).to_bytes(2, "big") + b"\x80" + packet)
+            for block in range(50)
+        ))
+        for cluster in range(clusters)
+    )
+    return header + _encode_id(SEGMENT) + UNKNOWN_SIZE + info + tracks + body
+
+def exercise(data: bytes):
+    """Parse, measure and slice a clip the way the upload and VAD paths do"""
+    clip = parse_webm(data)
+    clip.duration
+    slice_webm(clip, 0.5, 2.0)
+
+def assert_rejected(data: bytes):
+    try:
+        exercise(data)
+    except WebmError:
+        return
+    raise AssertionError("malformed clip was accepted")
+
+def test_valid_clip():
+    clip = parse_webm(build_clip())
+    assert len(clip.blocks) == 200
+    assert abs(clip.duration - 4.0) < 1e-9
+    assert len(parse_webm(slice_webm(clip, 1.0, 2.0)).blocks) == 50
+
+def test_bad_sampling_frequency_size():
+    assert_rejected(build_clip(sampling_frequency=b"\x47\x3b\x80"))
+
+def test_oversized_timecode_scale():
+    assert_rejected(build_clip(info=_element(INFO, _element(TIMECODE_SCALE, b"\xff" * 200))))
+
+def test_missing_tracks_element():
+    entry = _element(TRACK_ENTRY, _element(TRACK_NUMBER, _uint(1)), _element(CODEC_ID, b"A_OPUS"))
+    assert_rejected(build_clip(tracks=entry))
+
+def test_truncated_clips():
+    data = build_clip(clusters=2)
+    for length in range(len(data)):
+        try:
+            exercise(data[:length])
+        except WebmError:
+            pass
+
+def test_corrupted_clips():
+    data = build_clip()
+    rng = random.Random(0)
+    for _ in range(5000):
+        corrupted = bytearray(data)
+        for _ in range(rng.randint(1, 4)):
+            # Mostly hit the headers, where sizes and IDs live
+            position = rng.randrange(400 if rng.random() < 0.7 else len(corrupted))
+            corrupted[position] = rng.randrange(256)
+        try:
+            exercise(bytes(corrupted))
+        except WebmError:
+            pass
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"✅ {name}")
+    print("\n🎉 All WebM tests passed!")
@@ -0,0 +1,201 @@
+"""
+Voice activity detection and silence trimming before transcription
+
+Clips are decoded with PyAV to 16 kHz mono and split into short frames.
+Per-frame energy and zero-crossing rate are computed with NumPy in one pass,
+speech is located from them, and leading/trailing silence is cut off at
+packet boundaries without re-encoding (webm.slice_webm, or a PyAV remux for
+other containers). Clips without any speech are reported as such so they
+never reach Whisper.
+
+The same frame analysis picks the quiet moments at which long recordings
+are split for parallel transcription.
+
+NumPy and PyAV are optional: without them, or for audio PyAV cannot read,
+clips are passed through unchanged.
+"""
+import io
+import logging
+import os
+from typing import List, NamedTuple, Optional
+
+try:
+    import av
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependencies
+    av = None
+    np = None
+
+from webm import is_webm, parse_webm, slice_webm
+
+logger = logging.getLogger(__name__)
+
+VAD_ENABLED = os.getenv("VAD_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Frames quieter than this (dBFS) are never speech
+VAD_ENERGY_THRESHOLD_DB = float(os.getenv("VAD_ENERGY_THRESHOLD_DB", "-50"))
+
+# Silence kept around the detected speech, in milliseconds
+VAD_PADDING_MS = int(os.getenv("VAD_PADDING_MS", "250"))
+
+SAMPLE_RATE = 16000
+FRAME_MS = 30
+
+# Speech must be this much louder than the clip's noise floor (its quietest frames)
+NOISE_MARGIN_DB = 10.0
+
+# ...but never need to be closer than this to the loudest frame, so clips that are all speech are kept
+DYNAMIC_RANGE_DB = 25.0
+
+# Quiet frames with this many sign changes per sample are fricatives (s, f, sh) rather than hum
+FRICATIVE_ZCR = 0.25
+
+# Less detected speech than this counts as an empty clip
+MIN_SPEECH_MS = 150
+
+# Trimming less than this is not worth a remux
+MIN_TRIM_SECONDS = 0.3
+
+# How far before each chunk boundary to look for a pause when splitting a long clip
+SPLIT_SEARCH_SECONDS = 5.0
+
+class VadResult(NamedTuple):
+    audio: bytes
+    speech: bool
+    duration: Optional[float] = None  # of the original clip
+    trimmed: float = 0.0
+    energy_db: Optional["np.ndarray"] = None  # per frame of `audio`, for split_at_silence
+
+    @property
+    def kept(self) -> Optional[float]:
+        """Duration of `audio`, when the clip could be decoded"""
+        return None if self.duration is None else self.duration - self.trimmed
+
+def vad_available() -> bool:
+    return VAD_ENABLED and av is not None and np is not None
+
+def decode_pcm(audio: bytes, rate: int = SAMPLE_RATE) -> "np.ndarray":
+    """Decode a clip to mono float32 samples in [-1, 1]"""
+    chunks = []
+    with av.open(io.BytesIO(audio)) as container:
+        stream = container.streams.audio[0]
+        resampler = av.AudioResampler(format="flt", layout="mono", rate=rate)
+        for frame in container.decode(stream):
+            for resampled in resampler.resample(frame):
+                chunks.append(resampled.to_ndarray()[0])
+        for resampled in resampler.resample(None):
+            chunks.append(resampled.to_ndarray()[0])
+    return np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.float32)
+
+def frame_features(samples: "np.ndarray", rate: int = SAMPLE_RATE):
+    """Energy (dBFS) and zero-crossing rate of each FRAME_MS frame"""
+    frame_len = rate * FRAME_MS // 1000
+    count = len(samples) // frame_len
+    frames = samples[:count * frame_len].reshape(count, frame_len)
+    energy_db = 10 * np.log10(np.mean(frames * frames, axis=1) + 1e-10)
+    signs = np.signbit(frames)
+    zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / frame_len
+    return energy_db, zcr
+
+def speech_frames(samples: "np.ndarray", rate: int = SAMPLE_RATE) -> "np.ndarray":
+    """Boolean mask of FRAME_MS frames that contain speech"""
+    return speech_mask(*frame_features(samples, rate))
+
+def speech_mask(energy_db: "np.ndarray", zcr: "np.ndarray") -> "np.ndarray":
+    """speech_frames from already computed frame features"""
+    if len(energy_db) == 0:
+        return np.zeros(0, dtype=bool)
+
+    noise_floor = np.percentile(energy_db, 10)
+    threshold = max(VAD_ENERGY_THRESHOLD_DB, min(noise_floor + NOISE_MARGIN_DB, energy_db.max() - DYNAMIC_RANGE_DB))
+    voiced = energy_db > threshold
+    fricative = (energy_db > threshold - NOISE_MARGIN_DB / 2) & (energy_db > VAD_ENERGY_THRESHOLD_DB) & (zcr > FRICATIVE_ZCR)
+    return voiced | fricative
+
+def cut_clip(audio: bytes, start: float, end: float) -> bytes:
+    """Keep the packets between `start` and `end` seconds, remuxed into a new webm without re-encoding"""
+    output = io.BytesIO()
+    with av.open(io.BytesIO(audio)) as source:
+        in_stream = source.streams.audio[0]
+        with av.open(output, "w", format="webm") as target:
+            out_stream = target.add_stream_from_template(in_stream)
+            offset = None
+            for packet in source.demux(in_stream):
+                if packet.pts is None:
+                    continue  # flush packet
+                timestamp = float(packet.pts * packet.time_base)
+                if timestamp < start or timestamp >= end:
+                    continue
+                if offset is None:
+                    offset = packet.pts
+                packet.pts -= offset
+                packet.dts = packet.pts
+                packet.stream = out_stream
+                target.mux(packet)
+    return output.getvalue()
+
+def trim_silence(audio: bytes) -> VadResult:
+    """Detect speech in a clip and cut off leading and trailing silence
+
+    CPU-bound; call it from a worker thread.
+    """
+    if not vad_available():
+        return VadResult(audio, True)
+    try:
+        samples = decode_pcm(audio)
+    except (av.FFmpegError, IndexError, ValueError) as e:
+        logger.warning(f"VAD could not decode audio, sending it as is: {e}")
+        return VadResult(audio, True)
+
+    duration = len(samples) / SAMPLE_RATE
+    energy_db, zcr = frame_features(samples)
+    speech = speech_mask(energy_db, zcr)
+    if np.count_nonzero(speech) * FRAME_MS < MIN_SPEECH_MS:
+        return VadResult(b"", False, duration, duration)
+
+    indices = np.flatnonzero(speech)
+    padding = VAD_PADDING_MS / 1000
+    start = max(0.0, indices[0] * FRAME_MS / 1000 - padding)
+    end = min(duration, (indices[-1] + 1) * FRAME_MS / 1000 + padding)
+    trimmed = duration - (end - start)
+    if trimmed < MIN_TRIM_SECONDS:
+        return VadResult(audio, True, duration, energy_db=energy_db)
+
+    try:
+        cut = slice_webm(audio, start, end) if is_webm(audio) else cut_clip(audio, start, end)
+    except (av.FFmpegError, ValueError) as e:
+        logger.warning(f"VAD could not trim audio, sending it as is: {e}")
+        return VadResult(audio, True, duration, energy_db=energy_db)
+    logger.info(f"VAD trimmed {trimmed:.2f}s of silence from a {duration:.2f}s clip")
+    first = int(start * 1000 / FRAME_MS)
+    return VadResult(cut, True, duration, trimmed, energy_db[first:first + int((end - start) * 1000 / FRAME_MS)])
+
+def split_at_silence(audio: bytes, chunk_seconds: float, energy_db: "np.ndarray" = None) -> List[bytes]:
+    """Cut a long WebM clip into pieces of at most `chunk_seconds`, each cut at the quietest moment before its limit
+
+    Pass the frame energies from trim_silence to avoid decoding the clip again. Without NumPy/PyAV
+    the cuts fall exactly on the limits. CPU-bound; call it from a worker thread.
+    """
+    clip = parse_webm(audio, max_seconds=0)
+    duration = clip.duration
+    if duration <= chunk_seconds:
+        return [audio]
+
+    if energy_db is None and av is not None and np is not None:
+        try:
+            energy_db, _ = frame_features(decode_pcm(audio))
+        except (av.FFmpegError, IndexError, ValueError) as e:
+            logger.warning(f"Could not decode audio to find pauses, splitting at fixed points: {e}")
+
+    cuts = [0.0]
+    while duration - cuts[-1] > chunk_seconds:
+        limit = cuts[-1] + chunk_seconds
+        cut = limit
+        if energy_db is not None:
+            first = int(max(cuts[-1] + chunk_seconds / 2, limit - SPLIT_SEARCH_SECONDS) * 1000 / FRAME_MS)
+            last = min(len(energy_db), int(limit * 1000 / FRAME_MS))
+            if first < last:
+                cut = (first + int(np.argmin(energy_db[first:last]))) * FRAME_MS / 1000
+        cuts.append(cut)
+    cuts.append(duration + 1)
+    return [slice_webm(clip, start, end) for start, end in zip(cuts, cuts[1:])]
@@ -0,0 +1,294 @@
+"""
+Minimal WebM (Matroska/EBML) demuxer for MediaRecorder audio
+
+Walks the EBML element tree of an uploaded clip without decoding any audio:
+it reads the track info and every block's timestamp and byte range, which is
+enough to validate an upload, measure its duration, find Opus packet
+boundaries and cut the clip at block boundaries. Payloads are memoryviews
+into the original upload, so nothing is copied until a slice is written.
+
+MediaRecorder writes the Segment and its Clusters with "unknown" sizes (it
+streams), so master elements are walked in place rather than skipped by size.
+"""
+import os
+import struct
+from functools import cached_property
+from typing import List, NamedTuple, Optional, Tuple
+
+EBML_MAGIC = b"\x1a\x45\xdf\xa3"
+
+# Element IDs, written with their length-marker bits as in the Matroska spec
+EBML = 0x1A45DFA3
+DOC_TYPE = 0x4282
+SEGMENT = 0x18538067
+INFO = 0x1549A966
+TIMECODE_SCALE = 0x2AD7B1
+DURATION = 0x4489
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+TRACK_NUMBER = 0xD7
+CODEC_ID = 0x86
+AUDIO = 0xE1
+SAMPLING_FREQUENCY = 0xB5
+CHANNELS = 0x9F
+CLUSTER = 0x1F43B675
+TIMECODE = 0xE7
+SIMPLE_BLOCK = 0xA3
+BLOCK_GROUP = 0xA0
+BLOCK = 0xA1
+
+# Master elements whose children are walked in place
+_CONTAINERS = {EBML, SEGMENT, INFO, TRACKS, TRACK_ENTRY, AUDIO, CLUSTER, BLOCK_GROUP}
+
+# Nanoseconds per timecode unit unless the file says otherwise (1 ms)
+DEFAULT_TIMECODE_SCALE = 1_000_000
+
+# Longest clip accepted, in seconds
+MAX_AUDIO_SECONDS = float(os.getenv("MAX_AUDIO_SECONDS", "300"))
+
+# Unsigned integer elements, at most 8 bytes long per the EBML spec
+_UINTS = {TIMECODE_SCALE, TRACK_NUMBER, CHANNELS, TIMECODE}
+
+# SimpleBlock flag marking a keyframe; every audio block is one
+KEYFRAME = 0x80
+
+class WebmError(ValueError):
+    """Raised when an upload is not valid WebM audio"""
+
+class Block(NamedTuple):
+    track: int
+    timecode: int       # absolute, in timecode units
+    flags: int
+    payload: memoryview  # the coded frame(s), e.g. one Opus packet
+
+class WebmClip:
+    """Structure of a parsed WebM clip; see parse_webm"""
+
+    def __init__(self, data: memoryview):
+        self.data = data
+        self.doc_type = None
+        self.timecode_scale = DEFAULT_TIMECODE_SCALE
+        self.codec_id = None
+        self.track_number = None
+        self.sample_rate = None
+        self.channels = None
+        self.ebml_header: Optional[memoryview] = None
+        self.info: List[memoryview] = []
+        self.tracks: Optional[memoryview] = None
+        self.blocks: List[Block] = []
+
+    def seconds(self, timecode: int) -> float:
+        return timecode * self.timecode_scale / 1e9
+
+    def packet_times(self) -> List[Tuple[float, float]]:
+        """Start and end of every block in seconds, relative to the first block"""
+        if not self.blocks:
+            return []
+        base = self.blocks[0].timecode
+        times = []
+        for index, block in enumerate(self.blocks):
+            start = self.seconds(block.timecode - base)
+            if self.codec_id == "A_OPUS":
+                end = start + opus_packet_duration(block.payload)
+            elif index + 1 < len(self.blocks):
+                end = self.seconds(self.blocks[index + 1].timecode - base)
+            else:
+                end = start
+            times.append((start, end))
+        return times
+
+    @cached_property
+    def duration(self) -> float:
+        times = self.packet_times()
+        return max(end for _, end in times) if times else 0.0
+
+def is_webm(data) -> bool:
+    return bytes(data[:4]) == EBML_MAGIC
+
+def read_vint(data: memoryview, pos: int, keep_marker: bool = False) -> Tuple[Optional[int], int]:
+    """Read an EBML variable-length integer; returns (value, next position), value None for "unknown size"""
+    if pos >= len(data):
+        raise WebmError("Truncated WebM: element header is cut off")
+    first = data[pos]
+    if first == 0:
+        raise WebmError(f"Invalid EBML integer at byte {pos}")
+    length = 9 - first.bit_length()
+    if pos + length > len(data):
+        raise WebmError("Truncated WebM: element header is cut off")
+    value = first if keep_marker else first & ((1 << (8 - length)) - 1)
+    for byte in data[pos + 1:pos + length]:
+        value = value << 8 | byte
+    if not keep_marker and value == (1 << 7 * length) - 1:
+        return None, pos + length
+    return value, pos + length
+
+def opus_packet_duration(packet) -> float:
+    """Duration of an Opus packet in seconds, from its TOC byte (RFC 6716 section 3.1)"""
+    if not len(packet):
+        return 0.0
+    toc = packet[0]
+    config = toc >> 3
+    if config < 12:
+        frame_ms = (10, 20, 40, 60)[config % 4]
+    elif config < 16:
+        frame_ms = (10, 20)[config % 2]
+    else:
+        frame_ms = (2.5, 5, 10, 20)[config % 4]
+    code = toc & 0x03
+    if code == 0:
+        frames = 1
+    elif code < 3:
+        frames = 2
+    else:
+        frames = packet[1] & 0x3F if len(packet) > 1 else 0
+    return frames * frame_ms / 1000
+
+def parse_webm(data, max_seconds: float = MAX_AUDIO_SECONDS) -> WebmClip:
+    """Parse a WebM audio clip, raising WebmError if it is malformed, truncated or too long"""
+    view = memoryview(data)
+    if not is_webm(view):
+        raise WebmError("Not a WebM file")
+
+    clip = WebmClip(view)
+    tracks = []
+    info_end = 0
+    cluster_timecode = None
+    first_timecode = None
+    pos = 0
+    while pos < len(view):
+        start = pos
+        element_id, pos = read_vint(view, pos, keep_marker=True)
+        size, pos = read_vint(view, pos)
+        end = len(view) if size is None else pos + size
+        if end > len(view):
+            raise WebmError(f"Truncated WebM: element 0x{element_id:X} is missing {end - len(view)} bytes")
+
+        if element_id in _CONTAINERS:
+            if size is None and element_id not in (SEGMENT, CLUSTER):
+                raise WebmError(f"Unsupported unknown-size element 0x{element_id:X}")
+            if element_id == EBML:
+                clip.ebml_header = view[start:end]
+            elif element_id == INFO:
+                info_end = end
+            elif element_id == TRACKS:
+                clip.tracks = view[start:end]
+            elif element_id == TRACK_ENTRY:
+                tracks.append({})
+            elif element_id == CLUSTER:
+                cluster_timecode = None
+            continue  # walk the children in place
+
+        if size is None:
+            raise WebmError(f"Element 0x{element_id:X} has an unknown size")
+        payload = view[pos:end]
+        if element_id in _UINTS and size > 8:
+            raise WebmError(f"Element 0x{element_id:X} is too long for an integer ({size} bytes)")
+        if element_id == SAMPLING_FREQUENCY and size not in (4, 8):
+            raise WebmError(f"Invalid sampling frequency size ({size} bytes)")
+        if element_id == DOC_TYPE:
+            clip.doc_type = bytes(payload).decode("ascii", "replace")
+        elif element_id == TIMECODE_SCALE:
+            clip.timecode_scale = int.from_bytes(payload, "big") or DEFAULT_TIMECODE_SCALE
+        elif element_id in (TRACK_NUMBER, CODEC_ID, SAMPLING_FREQUENCY, CHANNELS) and tracks:
+            tracks[-1][element_id] = payload
+        elif element_id == TIMECODE:
+            cluster_timecode = int.from_bytes(payload, "big")
+        elif element_id in (SIMPLE_BLOCK, BLOCK):
+            if cluster_timecode is None:
+                raise WebmError("Block found outside a cluster")
+            block = _read_block(payload, cluster_timecode, element_id == BLOCK)
+            if first_timecode is None:
+                first_timecode = block.timecode
+            elif max_seconds and clip.seconds(block.timecode - first_timecode) > max_seconds:
+                # Stop at the first block past the limit rather than walking the rest of the upload
+                raise WebmError(f"Audio is too long (over {max_seconds:.0f}s)")
+            clip.blocks.append(block)
+        if start < info_end and element_id != DURATION:
+            # Info is rewritten without Duration when the clip is sliced
+            clip.info.append(view[start:end])
+        pos = end
+
+    if clip.tracks is None:
+        raise WebmError("WebM file has no Tracks element")
+    _select_audio_track(clip, tracks)
+    if clip.doc_type != "webm":
+        raise WebmError(f"Unsupported document type: {clip.doc_type}")
+    if not clip.blocks:
+        raise WebmError("WebM file contains no audio")
+    duration = clip.duration
+    if max_seconds and duration > max_seconds:
+        raise WebmError(f"Audio is too long ({duration:.0f}s, limit {max_seconds:.0f}s)")
+    return clip
+
+def _read_block(payload: memoryview, cluster_timecode: int, in_group: bool) -> Block:
+    track, pos = read_vint(payload, 0)
+    if track is None or pos + 3 > len(payload):
+        raise WebmError("Truncated WebM: block header is cut off")
+    relative, flags = struct.unpack_from(">hB", payload, pos)
+    if in_group:
+        # Block flags have no keyframe bit; audio blocks are always keyframes
+        flags |= KEYFRAME
+    return Block(track, cluster_timecode + relative, flags, payload[pos + 3:])
+
+def _select_audio_track(clip: WebmClip, tracks: List[dict]):
+    """Keep only the blocks of the first audio track"""
+    for track in tracks:
+        codec = bytes(track.get(CODEC_ID, b"")).decode("ascii", "replace")
+        if codec.startswith("A_") and TRACK_NUMBER in track:
+            clip.codec_id = codec
+            clip.track_number = int.from_bytes(track[TRACK_NUMBER], "big")
+            if SAMPLING_FREQUENCY in track:
+                width = len(track[SAMPLING_FREQUENCY])
+                clip.sample_rate = struct.unpack(">f" if width == 4 else ">d", track[SAMPLING_FREQUENCY])[0]
+            if CHANNELS in track:
+                clip.channels = int.from_bytes(track[CHANNELS], "big")
+            break
+    else:
+        raise WebmError("WebM file has no audio track")
+    clip.blocks = [block for block in clip.blocks if block.track == clip.track_number]
+
+def _encode_id(element_id: int) -> bytes:
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, "big")
+
+def _encode_size(size: int) -> bytes:
+    length = 1
+    while size >= (1 << 7 * length) - 1:
+        length += 1
+    return (size | 1 << 7 * length).to_bytes(length, "big")
+
+def _element(element_id: int, *payload) -> bytes:
+    size = sum(len(part) for part in payload)
+    return b"".join((_encode_id(element_id), _encode_size(size), *payload))
+
+def _uint(value: int) -> bytes:
+    return value.to_bytes(max(1, (value.bit_length() + 7) // 8), "big")
+
+def slice_webm(data, start: float, end: float) -> bytes:
+    """Cut a clip to the blocks starting between `start` and `end` seconds, without re-encoding
+
+    Cuts fall on block (Opus packet) boundaries and timestamps are rebased to zero.
+    """
+    clip = data if isinstance(data, WebmClip) else parse_webm(data, max_seconds=0)
+    keep = [block for block, (begin, _) in zip(clip.blocks, clip.packet_times()) if start <= begin < end]
+    if not keep:
+        raise WebmError("No audio in the requested range")
+
+    clusters = []
+    base = keep[0].timecode
+    cluster_timecode = None
+    cluster = []
+    for block in keep:
+        timecode = block.timecode - base
+        if timecode < 0 or (cluster_timecode is not None and timecode - cluster_timecode < -0x8000):
+            raise WebmError("Block timecodes go backwards")
+        if cluster_timecode is None or timecode - cluster_timecode > 0x7FFF:
+            if cluster:
+                clusters.append(_element(CLUSTER, *cluster))
+            cluster_timecode = timecode
+            cluster = [_element(TIMECODE, _uint(timecode))]
+        header = _encode_size(block.track) + struct.pack(">hB", timecode - cluster_timecode, block.flags)
+        cluster.append(_element(SIMPLE_BLOCK, header, block.payload))
+    clusters.append(_element(CLUSTER, *cluster))
+
+    info = _element(INFO, *clip.info)
+    return bytes(clip.ebml_header) + _element(SEGMENT, info, clip.tracks, *clusters)